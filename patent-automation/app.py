@@ -6,6 +6,7 @@ from dotenv import load_dotenv
 import os
 from extensions import db
 from operations import operations
+from commands import embeddings_cli, index_cli, patents_cli
 
 load_dotenv()
 
@@ -18,6 +19,9 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db.init_app(app)
 migrate = Migrate(app, db)
+app.cli.add_command(index_cli)
+app.cli.add_command(patents_cli)
+app.cli.add_command(embeddings_cli)
 
 # Register the blueprint (no prefix is used here, so endpoints are at /submit, /search, etc.)
 app.register_blueprint(operations)
@@ -0,0 +1,220 @@
+# bench_api.py
+"""
+Benchmarks the API end to end, offline: /submit, /search and /generate are
+called through the Flask test client against a synthetic corpus grown to
+each scale in turn, at each concurrency level, with fake_openai.py standing
+in for OpenAI:
+
+    python bench_api.py --scales 1000,10000,100000 --concurrency 1,4,16
+    python bench_api.py --scales 1000000 --backend hnsw --json results.json
+
+For every (scale, endpoint, concurrency) it reports throughput, latency
+percentiles and the mean time per request spent in each stage (embed,
+index_search, keyword_search, index_append, db, llm; see stage_timing.py),
+so a regression shows up together with the stage that caused it. /generate
+latency runs until the job is done. By default a bag-of-words hashing
+embedder stands in for the sentence model (see bench_search.py);
+--real-model uses the configured embedding backend.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from bench_search import HashingEmbedder, make_corpus, percentiles
+
+ENDPOINTS = ("submit", "search", "generate")
+
+
+def start_fake_openai(port, words, token_delay):
+    process = subprocess.Popen(
+        [sys.executable, "fake_openai.py", "--port", str(port), "--words", str(words),
+         "--token-delay", str(token_delay)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    sys.exit(f"fake_openai.py did not start on port {port}.")
+
+
+def grow_corpus(app, operations, corpus, start, stop, chunk=5000):
+    """
+    Insert synthetic patents [start, stop) into the database and both indexes.
+    """
+    from sqlalchemy import func, insert, select
+
+    from extensions import db
+    from models import Patent
+
+    titles, descriptions, _ = corpus
+    index_store = operations.get_index_store()
+    lexical_index = operations.get_lexical_index()
+    with app.app_context():
+        for begin in range(start, stop, chunk):
+            end = min(begin + chunk, stop)
+            # Patents submitted by earlier runs take ids too; continue after them.
+            first_id = (db.session.scalar(select(func.max(Patent.id))) or 0) + 1
+            ids = list(range(first_id, first_id + end - begin))
+            db.session.execute(insert(Patent), [
+                {"id": patent_id, "title": titles[i], "description": descriptions[i]}
+                for i, patent_id in zip(range(begin, end), ids)
+            ])
+            db.session.commit()
+            chunk_patent_ids, embeddings = operations.get_document_embeddings(ids, descriptions[begin:end])
+            index_store.add(chunk_patent_ids, embeddings, checkpoint=False)
+            lexical_index.add(ids, titles[begin:end], descriptions[begin:end])
+    index_store.checkpoint()
+
+
+def make_requests(endpoint, count, run_id, corpus, rng):
+    _, descriptions, part_numbers = corpus
+    if endpoint == "search":
+        targets = rng.integers(0, len(descriptions), size=count)
+        return [{"query": " ".join(rng.choice(descriptions[i].split(), size=4)) + " " + part_numbers[i]}
+                for i in targets]
+    # Unique titles: /submit requires them, and /generate would otherwise be served from its cache.
+    words = descriptions[0].split()
+    return [{"title": f"Benchmark {endpoint} {run_id}-{i}",
+             "description": " ".join(rng.choice(words, size=40)) + f" bench{run_id}x{i}"}
+            for i in range(count)]
+
+
+def call(client, endpoint, body, number):
+    """
+    Make one request; returns its latency in seconds, or None if it failed.
+    """
+    started = time.perf_counter()
+    if endpoint != "generate":
+        response = client.post(f"/{endpoint}", json=body)
+        return time.perf_counter() - started if response.status_code == 200 else None
+
+    # A client id per request keeps the per-client job limit out of the way.
+    response = client.post("/generate", json=body, headers={"X-Client-Id": f"bench-{number}"})
+    if response.status_code != 202:
+        return None
+    status_url = response.get_json()["status_url"]
+    while True:
+        job = client.get(status_url).get_json()
+        if job["status"] in ("done", "error"):
+            return time.perf_counter() - started if job["status"] == "done" else None
+        time.sleep(0.005)
+
+
+def run(app, operations, endpoint, bodies, concurrency):
+    client = app.test_client()
+    stages_before = operations.stage_timer.stats()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(lambda item: call(client, endpoint, item[1], item[0]), enumerate(bodies)))
+    elapsed = time.perf_counter() - started
+    stages_after = operations.stage_timer.stats()
+
+    succeeded = [latency * 1000 for latency in latencies if latency is not None]
+    stages = {}
+    for name, after in stages_after.items():
+        before = stages_before.get(name, {"total_seconds": 0.0})
+        stages[name] = (after["total_seconds"] - before["total_seconds"]) * 1000 / len(bodies)
+    return {
+        "requests": len(bodies),
+        "errors": len(bodies) - len(succeeded),
+        "throughput": len(succeeded) / elapsed,
+        **(percentiles(succeeded) if succeeded else {"mean": None, "p50": None, "p95": None}),
+        "stages_ms": {name: ms for name, ms in stages.items() if ms > 0},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /submit, /search and /generate offline.")
+    parser.add_argument("--scales", default="1000,10000,100000",
+                        help="Comma-separated corpus sizes (indexed vectors) to benchmark at.")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated numbers of concurrent clients.")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=200, help="Requests per /submit and /search run.")
+    parser.add_argument("--generate-requests", type=int, default=20, help="Requests per /generate run.")
+    parser.add_argument("--words-per-doc", type=int, default=60)
+    parser.add_argument("--vocabulary", type=int, default=20_000)
+    parser.add_argument("--backend", default="auto", help="FAISS backend of the snapshots (see index_backends.py).")
+    parser.add_argument("--real-model", action="store_true", help="Embed with the configured embedding backend.")
+    parser.add_argument("--openai-port", type=int, default=8011)
+    parser.add_argument("--completion-words", type=int, default=400)
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between fake streamed words.")
+    parser.add_argument("--dir", default=None, help="Directory for the database and indexes (default: temporary).")
+    parser.add_argument("--json", default=None, help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    scales = sorted(int(scale) for scale in args.scales.split(","))
+    levels = [int(level) for level in args.concurrency.split(",")]
+    endpoints = [endpoint for endpoint in args.endpoints.split(",") if endpoint]
+    directory = args.dir or tempfile.mkdtemp(prefix="bench_api_")
+    # Measure uncached requests, and configure the app before operations.py reads its settings.
+    os.environ.update(
+        FAISS_INDEX_DIR=directory,
+        FAISS_INDEX_BACKEND=args.backend,
+        DATABASE_URI=f"sqlite:///{os.path.join(directory, 'bench.db')}?timeout=60",
+        OPENAI_API_KEY="fake",
+        OPENAI_API_BASE=f"http://127.0.0.1:{args.openai_port}/v1",
+        SEARCH_CACHE_MB="0",
+        EMBED_CACHE_MB="0",
+        GENERATION_WORKERS=str(max(levels)),
+        GENERATION_MAX_PENDING=str(max(args.generate_requests, max(levels)) * 2),
+    )
+    fake_openai = start_fake_openai(args.openai_port, args.completion_words, args.token_delay)
+    try:
+        from app import app
+        from extensions import db
+        from model_registry import registry
+        import operations
+
+        if not args.real_model:
+            registry.register("embedding_model", lambda: HashingEmbedder(operations.dimension))
+        with app.app_context():
+            db.create_all()
+        operations.warm_up()
+
+        corpus = make_corpus(scales[-1], args.words_per_doc, args.vocabulary)
+        rng = np.random.default_rng(1)
+        results = []
+        indexed = 0
+        print(f"{'vectors':>9} {'endpoint':<9}{'clients':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}  "
+              "stages (ms/request)")
+        for scale in scales:
+            started = time.perf_counter()
+            grow_corpus(app, operations, corpus, indexed, scale)
+            indexed = scale
+            print(f"-- {scale} patents loaded in {time.perf_counter() - started:.1f}s "
+                  f"({operations.get_index_store().manifest.get('backend', 'flat')} snapshot)")
+            for endpoint in endpoints:
+                count = args.generate_requests if endpoint == "generate" else args.requests
+                for concurrency in levels:
+                    bodies = make_requests(endpoint, count, f"{scale}-{concurrency}", corpus, rng)
+                    result = run(app, operations, endpoint, bodies, concurrency)
+                    results.append(dict(result, vectors=scale, endpoint=endpoint, concurrency=concurrency))
+                    stages = ", ".join(f"{name} {ms:.2f}" for name, ms in sorted(result["stages_ms"].items()))
+                    p50 = f"{result['p50']:.1f}" if result["p50"] is not None else "-"
+                    p95 = f"{result['p95']:.1f}" if result["p95"] is not None else "-"
+                    errors = f"  [{result['errors']} failed]" if result["errors"] else ""
+                    print(f"{scale:>9} {endpoint:<9}{concurrency:>8}{result['throughput']:>9.1f}{p50:>9}{p95:>9}  "
+                          f"{stages}{errors}")
+    finally:
+        fake_openai.kill()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# bench_search.py
+"""
+Benchmarks /search retrieval latency per mode (dense, hybrid, prefilter, and
+the BM25 keyword index alone) on a synthetic corpus:
+
+    python bench_search.py --docs 100000 --queries 200
+    python bench_search.py --docs 100000 --backend sq8 --real-model
+
+Each synthetic patent has a unique part number (e.g. "XR-48213/7"); every
+query is a few words from one patent plus its part number, and "hit@k" is
+how often that patent is among the k results. By default a bag-of-words
+hashing embedder stands in for the sentence model so that only retrieval is
+measured; --real-model uses the configured embedding backend.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+
+class HashingEmbedder:
+    """
+    Sum of fixed random vectors of a text's words: fast, deterministic and
+    similar for texts sharing words, which is all the benchmark needs.
+    """
+
+    def __init__(self, dimension):
+        self.dimension = dimension
+        self.vectors = {}
+
+    def _vector(self, word):
+        vector = self.vectors.get(word)
+        if vector is None:
+            rng = np.random.default_rng(zlib.crc32(word.encode("utf-8")))
+            vector = rng.standard_normal(self.dimension).astype("float32")
+            self.vectors[word] = vector
+        return vector
+
+    def encode(self, texts, batch_size=32):
+        embeddings = np.zeros((len(texts), self.dimension), dtype="float32")
+        for row, text in zip(embeddings, texts):
+            for word in text.lower().split():
+                row += self._vector(word)
+        return embeddings
+
+
+def make_corpus(num_docs, words_per_doc, vocabulary_size, seed=0):
+    rng = np.random.default_rng(seed)
+    vocabulary = [f"term{i}" for i in range(vocabulary_size)]
+    # Zipf-like word frequencies, as in real text.
+    weights = 1.0 / np.arange(1, vocabulary_size + 1)
+    weights /= weights.sum()
+    word_ids = rng.choice(vocabulary_size, size=(num_docs, words_per_doc), p=weights)
+    part_numbers = [f"XR-{i:05d}/{i % 9}" for i in range(num_docs)]
+    titles = [f"Assembly {part_numbers[i]} {vocabulary[word_ids[i, 0]]}" for i in range(num_docs)]
+    descriptions = [
+        " ".join(vocabulary[w] for w in word_ids[i]) + f" using part {part_numbers[i]}." for i in range(num_docs)
+    ]
+    return titles, descriptions, part_numbers
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {
+        "mean": statistics.fmean(samples),
+        "p50": samples[len(samples) // 2],
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dense, keyword and hybrid patent search.")
+    parser.add_argument("--docs", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--words-per-doc", type=int, default=80)
+    parser.add_argument("--vocabulary", type=int, default=20_000)
+    parser.add_argument("--backend", default="flat", help="FAISS backend of the snapshot (see index_backends.py).")
+    parser.add_argument("--dir", default=None, help="Directory for the indexes (default: a temporary one).")
+    parser.add_argument("--real-model", action="store_true", help="Embed with the configured embedding backend.")
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix="bench_search_")
+    # Measure every query uncached, and configure the app before operations.py reads its settings.
+    os.environ.update(FAISS_INDEX_DIR=directory, FAISS_INDEX_BACKEND=args.backend,
+                      SEARCH_CACHE_MB="0", EMBED_CACHE_MB="0", EMBED_MAX_BATCH_SIZE="1")
+    import operations
+    from model_registry import registry
+
+    if not args.real_model:
+        registry.register("embedding_model", lambda: HashingEmbedder(operations.dimension))
+
+    titles, descriptions, part_numbers = make_corpus(args.docs, args.words_per_doc, args.vocabulary)
+    index_store = operations.get_index_store()
+    lexical_index = operations.get_lexical_index()
+    if index_store.ntotal == 0:
+        print(f"Indexing {args.docs} synthetic patents in {directory}...")
+        started = time.perf_counter()
+        for start in range(0, args.docs, 5000):
+            ids = np.arange(start + 1, min(start + 5000, args.docs) + 1)
+            texts = descriptions[start:start + 5000]
+            chunk_patent_ids, embeddings = operations.get_document_embeddings(ids, texts)
+            index_store.add(chunk_patent_ids, embeddings, checkpoint=False)
+            lexical_index.add(ids, titles[start:start + 5000], texts)
+        index_store.checkpoint()
+        print(f"  vectors indexed and snapshotted ({index_store.manifest.get('backend')}) "
+              f"in {time.perf_counter() - started:.1f}s")
+
+    rng = np.random.default_rng(1)
+    targets = rng.choice(args.docs, size=args.queries, replace=False)
+    queries = [
+        " ".join(rng.choice(descriptions[i].split()[:args.words_per_doc], size=4)) + " " + part_numbers[i]
+        for i in targets
+    ]
+
+    def keyword_only(query):
+        return [(patent_id, None, score) for patent_id, score in lexical_index.search(query, args.k)]
+
+    searches = {"keyword (BM25)": keyword_only}
+    for mode in operations.SEARCH_MODES:
+        searches[mode] = lambda query, mode=mode: operations.search_patents(query, k=args.k, mode=mode)
+
+    print(f"{'mode':<16}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'hit@' + str(args.k):>10}")
+    for name, search in searches.items():
+        search(queries[0])  # Warm-up.
+        latencies = []
+        hits = 0
+        for target, query in zip(targets, queries):
+            started = time.perf_counter()
+            results = search(query)
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits += any(patent_id == target + 1 for patent_id, _, _ in results)
+        stats = percentiles(latencies)
+        print(f"{name:<16}{stats['mean']:>10.2f}{stats['p50']:>10.2f}{stats['p95']:>10.2f}"
+              f"{hits / len(queries):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
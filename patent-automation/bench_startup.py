@@ -0,0 +1,84 @@
+# bench_startup.py
+"""
+Measures how long importing the app takes and how much memory it uses, each
+in a fresh interpreter, so startup regressions (e.g. a heavy import creeping
+back to module level) are caught:
+
+    python bench_startup.py                      # import app, report
+    python bench_startup.py --warm-up            # also load the models
+    python bench_startup.py --max-seconds 1.5 --max-rss-mb 250
+
+Exits with status 1 if a limit is exceeded. Heavy packages that were
+imported are listed, so the report shows which one a regression pulled in.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ("torch", "sentence_transformers", "faiss", "openai", "transformers")
+
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter() - started
+warmed = None
+if {warm_up}:
+    from operations import warm_up
+    started = time.perf_counter()
+    warm_up()
+    warmed = time.perf_counter() - started
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{
+    "import_seconds": imported,
+    "warm_up_seconds": warmed,
+    "max_rss_mb": rss / 1024 if sys.platform != "darwin" else rss / 1024 / 1024,
+    "heavy_modules": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def run_probe(module, warm_up):
+    code = PROBE.format(module=module, warm_up=warm_up, heavy=HEAVY_MODULES)
+    # No API key, so the app must start without one.
+    env = {key: value for key, value in os.environ.items() if key != "OPENAI_API_KEY"}
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    if result.returncode != 0:
+        sys.exit(f"Importing {module} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app import time and memory.")
+    parser.add_argument("--module", default="app", help="Module to import (default: app).")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to measure; the median is reported.")
+    parser.add_argument("--warm-up", action="store_true", help="Also call operations.warm_up() after importing.")
+    parser.add_argument("--max-seconds", type=float, default=None, help="Fail if the median import time exceeds this.")
+    parser.add_argument("--max-rss-mb", type=float, default=None, help="Fail if the median peak RSS exceeds this.")
+    args = parser.parse_args()
+
+    runs = [run_probe(args.module, args.warm_up) for _ in range(args.runs)]
+    import_seconds = statistics.median(run["import_seconds"] for run in runs)
+    max_rss_mb = statistics.median(run["max_rss_mb"] for run in runs)
+    print(f"import {args.module}: {import_seconds:.3f}s median over {args.runs} runs, "
+          f"peak RSS {max_rss_mb:.0f} MB")
+    if args.warm_up:
+        warm_up_seconds = statistics.median(run["warm_up_seconds"] for run in runs)
+        print(f"warm_up(): {warm_up_seconds:.3f}s")
+    print(f"heavy modules loaded: {', '.join(runs[0]['heavy_modules']) or 'none'}")
+
+    failures = []
+    if args.max_seconds is not None and import_seconds > args.max_seconds:
+        failures.append(f"import took {import_seconds:.3f}s (limit {args.max_seconds}s)")
+    if args.max_rss_mb is not None and max_rss_mb > args.max_rss_mb:
+        failures.append(f"peak RSS was {max_rss_mb:.0f} MB (limit {args.max_rss_mb} MB)")
+    if failures:
+        sys.exit("Startup regression: " + "; ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+# caches.py
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_text(text):
+    """
+    Canonical form of a query for cache keys: case-folded, whitespace collapsed.
+    all-MiniLM-L6-v2 is uncased, so this does not change the embedding.
+    """
+    return " ".join(text.casefold().split())
+
+
+def text_key(text):
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def _entry_size(value):
+    """
+    Approximate memory held by a cached value: numpy data, or the deep size
+    of tuples and lists (e.g. ranked (patent_id, similarity) pairs).
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(_entry_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by the total size of its values in bytes.
+
+    If `spill_dir` is given, numpy values evicted from memory are written
+    there and read back (and promoted) on a later miss; a promoted value's
+    file is deleted. This process keeps the spilled files it knows of
+    (including those found at startup) under `spill_max_bytes`, deleting
+    the oldest first.
+    """
+
+    def __init__(self, max_bytes, spill_dir=None, spill_max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self._spilled = OrderedDict()
+        self._spilled_bytes = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.spill_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            paths = [entry for entry in os.scandir(spill_dir) if entry.name.endswith(".npy")]
+            for entry in sorted(paths, key=lambda entry: entry.stat().st_mtime):
+                self._spilled[entry.name[:-len(".npy")]] = entry.stat().st_size
+                self._spilled_bytes += entry.stat().st_size
+            self._trim_spilled()
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{key}.npy")
+
+    def _spill(self, key, value):
+        np.save(self._spill_path(key), value)
+        size = os.path.getsize(self._spill_path(key))
+        with self._lock:
+            self._spilled_bytes += size - self._spilled.pop(key, 0)
+            self._spilled[key] = size
+
+    def _forget_spilled(self, key):
+        with self._lock:
+            self._spilled_bytes -= self._spilled.pop(key, 0)
+        try:
+            os.remove(self._spill_path(key))
+        except FileNotFoundError:  # Promoted or trimmed by another worker sharing the directory.
+            pass
+
+    def _trim_spilled(self):
+        while True:
+            with self._lock:
+                if self._spilled_bytes <= self.spill_max_bytes or not self._spilled:
+                    return
+                key = next(iter(self._spilled))
+            self._forget_spilled(key)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        if self.spill_dir and os.path.exists(self._spill_path(key)):
+            try:
+                value = np.load(self._spill_path(key))
+            except (OSError, ValueError):
+                value = None
+            if value is not None:
+                self._forget_spilled(key)
+                self.put(key, value)
+                with self._lock:
+                    self.spill_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        size = _entry_size(value)
+        if size > self.max_bytes:
+            return
+        spilled = []
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= _entry_size(self._entries.pop(key))
+            self._entries[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                old_key, old_value = self._entries.popitem(last=False)
+                self._bytes -= _entry_size(old_value)
+                self.evictions += 1
+                spilled.append((old_key, old_value))
+        if self.spill_dir:
+            for old_key, old_value in spilled:
+                if isinstance(old_value, np.ndarray):
+                    self._spill(old_key, old_value)
+            self._trim_spilled()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.spill_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "spill_hits": self.spill_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.spill_hits) / lookups if lookups else 0.0,
+            }
+
+
+class GenerationCache(LRUCache):
+    """
+    LRU cache whose entries are only valid for one index generation.
+    Looking up with a newer generation drops everything cached so far.
+    """
+
+    def __init__(self, max_bytes):
+        super().__init__(max_bytes)
+        self.generation = None
+        self.invalidations = 0
+
+    def _sync(self, generation):
+        with self._lock:
+            if generation == self.generation:
+                return
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+            self.generation = generation
+
+    def get(self, key, generation):
+        self._sync(generation)
+        return super().get(key)
+
+    def put(self, key, value, generation):
+        with self._lock:
+            if self.generation is not None and generation < self.generation:
+                return  # Computed against an index that has since changed.
+        self._sync(generation)
+        super().put(key, value)
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(generation=self.generation, invalidations=self.invalidations)
+        return stats
@@ -0,0 +1,54 @@
+# chunking.py
+import numpy as np
+
+
+def split_into_windows(text, window_words, overlap_words=0):
+    """
+    Split `text` into windows of `window_words` words, each overlapping the
+    previous one by `overlap_words`, so that no part of a long description
+    falls past the embedding model's input limit. Texts that fit in one
+    window (or a `window_words` of 0, i.e. chunking disabled) are returned
+    unchanged as a single chunk. The overlap must be smaller than the window.
+    """
+    words = text.split()
+    if window_words <= 0 or len(words) <= window_words:
+        return [text]
+    if not 0 <= overlap_words < window_words:
+        raise ValueError(f"Window overlap {overlap_words} must be at least 0 and less than {window_words} words.")
+    step = window_words - overlap_words
+    starts = range(0, len(words) - overlap_words, step)
+    return [" ".join(words[start:start + window_words]) for start in starts]
+
+
+def chunk_documents(patent_ids, texts, window_words, overlap_words=0):
+    """
+    Split every text into windows. Returns (chunk_patent_ids, chunks): an
+    int64 array with the owning patent id of each chunk, and the chunk
+    texts, in input order.
+    """
+    counts = []
+    chunks = []
+    for text in texts:
+        windows = split_into_windows(text, window_words, overlap_words)
+        counts.append(len(windows))
+        chunks.extend(windows)
+    return np.repeat(np.asarray(patent_ids, dtype="int64"), counts), chunks
+
+
+def max_sim_per_patent(similarities, patent_ids):
+    """
+    Collapse search hits of any shape (e.g. several query chunks times
+    several indexed chunks) into each patent's best similarity.
+    Returns (patent_ids, similarities) sorted by similarity, best first;
+    empty slots (patent id -1) are dropped.
+    """
+    similarities = np.asarray(similarities).ravel()
+    patent_ids = np.asarray(patent_ids).ravel()
+    valid = patent_ids >= 0
+    similarities, patent_ids = similarities[valid], patent_ids[valid]
+    order = np.argsort(-similarities, kind="stable")
+    # After sorting, the first hit of each patent is its best one.
+    unique_ids, first = np.unique(patent_ids[order], return_index=True)
+    best = similarities[order][first]
+    order = np.argsort(-best, kind="stable")
+    return unique_ids[order], best[order]
@@ -0,0 +1,331 @@
+# commands.py
+import json
+import re
+import time
+from datetime import datetime
+
+import click
+import numpy as np
+from flask.cli import AppGroup
+from sqlalchemy import func, insert, select
+
+from embedding_backends import EMBEDDING_BACKENDS, export_onnx, parity_report
+from extensions import db
+from file_locks import lock_file
+from index_backends import BACKENDS, calibrate
+from models import IndexOutbox, Patent
+from operations import (
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_ONNX_DIR,
+    get_document_embeddings,
+    get_index_store,
+    get_lexical_index,
+    index_outbox,
+    load_embedding_model,
+)
+
+# Flask CLI commands for maintaining the FAISS index: `flask index ...`
+index_cli = AppGroup("index", help="Maintain the FAISS patent index.")
+
+# Flask CLI commands for loading patents in bulk: `flask patents ...`
+patents_cli = AppGroup("patents", help="Load patents into the database and index.")
+
+# Flask CLI commands for the embedding model backends: `flask embeddings ...`
+embeddings_cli = AppGroup("embeddings", help="Prepare and compare embedding model backends.")
+
+TITLE_MAX_LENGTH = Patent.__table__.c.title.type.length
+
+
+@index_cli.command("backfill")
+@click.option("--rebuild", is_flag=True, help="Discard the current index and re-embed every patent.")
+@click.option("--start-after", type=int, default=0,
+              help="Only check patents with a higher id.")
+@click.option("--chunk-size", type=int, default=2048, show_default=True,
+              help="Rows fetched from the database and added to FAISS per chunk.")
+@click.option("--batch-size", type=int, default=256, show_default=True,
+              help="Batch size passed to the embedding model.")
+def backfill_command(rebuild, start_after, chunk_size, batch_size):
+    """
+    Embed the rows of the patents table missing from the FAISS index into
+    it, in id order, and add those missing from the BM25 keyword index.
+
+    Rows are streamed with a server-side cursor, so memory stays bounded by
+    `chunk-size` (plus the ids already indexed). Every chunk is durably
+    appended to the index write-ahead log before the next one is read, so
+    an interrupted run can simply be started again. Patents are looked up
+    by id rather than resumed after the highest indexed id, so gaps below
+    it (rows whose index append was lost) are filled too. Appends take the
+    index outbox lock and re-check for missing ids under it, so patents the
+    API indexes meanwhile are not appended twice.
+    """
+    index_store = get_index_store()
+    lexical_index = get_lexical_index()
+    if rebuild:
+        index_store.reset()
+        lexical_index.reset()
+    index_store.refresh()
+    indexed_ids, indexed_generation = index_store.patent_ids(), index_store.generation
+
+    stmt = (
+        select(Patent.id, Patent.title, Patent.description)
+        .where(Patent.id > start_after)
+        .order_by(Patent.id)
+        .execution_options(stream_results=True, yield_per=chunk_size)
+    )
+    click.echo(f"Indexing patents with id > {start_after} missing from the indexes...")
+
+    started = time.perf_counter()
+    total = indexed = 0
+    for rows in db.session.execute(stmt).partitions():
+        missing = ~np.isin([row.id for row in rows], indexed_ids)
+        vector_rows = [row for row, is_missing in zip(rows, missing) if is_missing]
+        embedded = 0
+        if vector_rows:
+            chunk_patent_ids, embeddings = get_document_embeddings(
+                [row.id for row in vector_rows], [row.description for row in vector_rows], batch_size=batch_size
+            )
+            with lock_file(index_outbox.lock_path):
+                index_store.refresh()
+                if index_store.generation != indexed_generation:  # Someone else appended since.
+                    indexed_ids = index_store.patent_ids()
+                keep = ~np.isin(chunk_patent_ids, indexed_ids)
+                if keep.any():
+                    index_store.add(chunk_patent_ids[keep], embeddings[keep], checkpoint=False)
+                    indexed_ids = np.union1d(indexed_ids, chunk_patent_ids[keep])
+                indexed_generation = index_store.generation
+            embedded = len(np.unique(chunk_patent_ids[keep]))
+        # The keyword index skips the patents it already holds.
+        lexical_index.add([row.id for row in rows], [row.title for row in rows], [row.description for row in rows])
+
+        total += len(rows)
+        indexed += embedded
+        elapsed = time.perf_counter() - started
+        click.echo(f"  {total} rows checked, {indexed} embedded (last id {rows[-1].id}, {total / elapsed:.1f} rows/s)")
+
+    index_store.checkpoint()
+    elapsed = time.perf_counter() - started
+    rate = total / elapsed if elapsed > 0 else 0.0
+    click.echo(f"Done: {total} rows checked, {indexed} embedded in {elapsed:.1f}s ({rate:.1f} rows/s); "
+               f"index holds {index_store.ntotal} vectors, "
+               f"keyword index {lexical_index.count()} patents.")
+
+
+@index_cli.command("checkpoint")
+@click.option("--backend", type=click.Choice(BACKENDS), default=None,
+              help="Rebuild the snapshot as this backend instead of FAISS_INDEX_BACKEND.")
+def checkpoint_command(backend):
+    """
+    Fold the write-ahead log into a new memory-mappable snapshot.
+
+    With --backend the snapshot is rebuilt from its stored vectors as that
+    backend; set FAISS_INDEX_BACKEND to match so later checkpoints keep it.
+    """
+    index_store = get_index_store()
+    if not index_store.checkpoint(backend=backend):
+        raise click.ClickException("Another process is checkpointing the index; try again later.")
+    manifest = index_store.manifest
+    click.echo(f"Snapshot version {index_store.version} ({manifest.get('backend', 'flat')}, "
+               f"{manifest.get('search_params') or 'exact search'}) holds {index_store.ntotal} vectors.")
+
+
+@index_cli.command("apply-outbox")
+def apply_outbox_command():
+    """
+    Index patents whose submission was committed but not yet indexed.
+
+    Workers do this in the background every INDEX_SYNC_INTERVAL seconds;
+    run it when no server is up to drain the outbox.
+    """
+    pending = index_outbox.pending()
+    applied = index_outbox.drain()
+    click.echo(f"Indexed {applied} of {pending} pending patents; {index_outbox.pending()} left in the outbox.")
+
+
+@index_cli.command("calibrate")
+@click.option("--k", type=int, default=5, show_default=True)
+@click.option("--target-recall", type=float, default=None,
+              help="Recall@k to aim for (default: FAISS_TARGET_RECALL).")
+def calibrate_command(k, target_recall):
+    """
+    Report recall@k and latency of the snapshot index against exact search.
+    """
+    index_store = get_index_store()
+    index_store.refresh()
+    backend = index_store.manifest.get("backend", "flat")
+    target_recall = index_store.target_recall if target_recall is None else target_recall
+    params, report = calibrate(index_store.base_index, backend, index_store.base_vectors,
+                               k=k, target_recall=target_recall, rerank_factor=index_store.rerank_factor)
+    if not report:
+        click.echo(f"The {backend} snapshot does exact search; nothing to calibrate.")
+        return
+    for value, recall, latency_ms in report:
+        click.echo(f"  {value:>5}: recall@{k} {recall:.3f}, {latency_ms:.3f} ms/query")
+    click.echo(f"Selected {params} for {backend} (current: {index_store.manifest.get('search_params')}).")
+
+
+# Whitespace and commas between the elements of a JSON array.
+ARRAY_SEPARATORS = re.compile(r"[\s,]*")
+
+
+def iter_json_records(path, read_size=1 << 20):
+    """
+    Stream records from a JSON array file or a JSON Lines file without
+    loading the whole file into memory.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buffer = f.read(read_size)
+        stripped = buffer.lstrip()
+        if not stripped.startswith("["):
+            lines = f"{buffer}{f.readline()}".splitlines()
+            yield from (json.loads(line) for line in lines if line.strip())
+            yield from (json.loads(line) for line in f if line.strip())
+            return
+
+        # JSON array: decode one element at a time from a position in the buffer, which is only
+        # sliced when refilled, so each byte is copied a bounded number of times.
+        buffer, pos = stripped, 1
+        while True:
+            pos = ARRAY_SEPARATORS.match(buffer, pos).end()
+            if buffer.startswith("]", pos):
+                return
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                more = f.read(read_size)
+                if not more:
+                    raise
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+            yield record
+            if len(buffer) - pos < read_size:
+                buffer, pos = buffer[pos:] + f.read(read_size), 0
+
+
+@patents_cli.command("ingest")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--chunk-size", type=int, default=5000, show_default=True,
+              help="Records inserted per transaction and embedded per batch.")
+@click.option("--batch-size", type=int, default=256, show_default=True,
+              help="Batch size passed to the embedding model.")
+@click.option("--rejects", type=click.Path(dir_okay=False, writable=True), default=None,
+              help="Write rejected records, with the reason, to this JSON Lines file.")
+def ingest_command(path, chunk_size, batch_size, rejects):
+    """
+    Bulk-load {"title", "description"} records from a JSON or JSON Lines
+    file, e.g. the output of datascrapingAIscript.py.
+
+    Titles are unique, so records whose title is already in the database
+    (or earlier in the file) are skipped. Each chunk is inserted with one
+    executemany INSERT, together with its index outbox rows, in one
+    commit, then the outbox is drained: the chunk is embedded in batched
+    encodes and appended to the FAISS and keyword indexes. Rows left in the
+    outbox by a run that dies after its commit are applied by the next
+    drain, here or in the API workers.
+    """
+    index_store = get_index_store()
+    counts = {"read": 0, "inserted": 0, "duplicates": 0, "rejected": 0}
+    seen_titles = set()
+    rejects_file = open(rejects, "w", encoding="utf-8") if rejects else None
+
+    def reject(record, reason):
+        counts["rejected"] += 1
+        if rejects_file:
+            rejects_file.write(json.dumps({"reason": reason, "record": record}, ensure_ascii=False) + "\n")
+
+    def flush(chunk):
+        existing = set(db.session.scalars(
+            select(Patent.title).where(Patent.title.in_([row["title"] for row in chunk]))
+        ))
+        rows = [row for row in chunk if row["title"] not in existing]
+        counts["duplicates"] += len(chunk) - len(rows)
+        if not rows:
+            return
+        inserted = db.session.scalars(insert(Patent).returning(Patent.id), rows).all()
+        created_at = datetime.utcnow()
+        db.session.execute(insert(IndexOutbox), [
+            {"patent_id": patent_id, "created_at": created_at} for patent_id in inserted
+        ])
+        db.session.commit()
+        index_outbox.drain(chunk_size=chunk_size, batch_size=batch_size, checkpoint=False)
+        counts["inserted"] += len(inserted)
+
+    started = time.perf_counter()
+    chunk = []
+    try:
+        for record in iter_json_records(path):
+            counts["read"] += 1
+            if not isinstance(record, dict):
+                reject(record, "not a JSON object")
+                continue
+            title = (record.get("title") or "").strip()
+            description = record.get("description")
+            if not title or not isinstance(description, str) or not description.strip():
+                reject(record, "title and description are required")
+                continue
+            if len(title) > TITLE_MAX_LENGTH:
+                reject(record, f"title longer than {TITLE_MAX_LENGTH} characters")
+                continue
+            if title in seen_titles:
+                counts["duplicates"] += 1
+                continue
+            seen_titles.add(title)
+            chunk.append({"title": title, "description": description})
+
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+                elapsed = time.perf_counter() - started
+                click.echo(f"  {counts['read']} records read, {counts['inserted']} inserted "
+                           f"({counts['read'] / elapsed:.1f} records/s)")
+        if chunk:
+            flush(chunk)
+    finally:
+        if rejects_file:
+            rejects_file.close()
+
+    index_store.checkpoint()
+    elapsed = time.perf_counter() - started
+    rate = counts["read"] / elapsed if elapsed > 0 else 0.0
+    click.echo(f"Done in {elapsed:.1f}s ({rate:.1f} records/s): {counts['read']} read, {counts['inserted']} inserted, "
+               f"{counts['duplicates']} duplicates skipped, {counts['rejected']} rejected.")
+
+
+@embeddings_cli.command("export")
+@click.option("--int8", is_flag=True, help="Also write the int8 dynamically quantized model.")
+def export_command(int8):
+    """
+    Export the embedding model to ONNX under EMBEDDING_ONNX_DIR, for the
+    onnx and onnx-int8 backends. They export on first use otherwise.
+    """
+    path = export_onnx(EMBEDDING_MODEL_NAME, EMBEDDING_ONNX_DIR, quantize=int8)
+    click.echo(f"Wrote {path}.")
+
+
+@embeddings_cli.command("parity")
+@click.option("--backend", type=click.Choice(EMBEDDING_BACKENDS), required=True,
+              help="Backend to compare against the PyTorch reference.")
+@click.option("--sample", type=int, default=256, show_default=True,
+              help="Number of random patent descriptions to embed.")
+@click.option("--batch-size", type=int, default=32, show_default=True)
+@click.option("--max-drift", type=float, default=None,
+              help="Fail if 1 - cosine similarity exceeds this for any description.")
+def parity_command(backend, sample, batch_size, max_drift):
+    """
+    Embed a sample of stored patent descriptions with both the reference
+    model and BACKEND, and report the cosine drift between them and the
+    speedup.
+    """
+    texts = db.session.scalars(select(Patent.description).order_by(func.random()).limit(sample)).all()
+    if not texts:
+        raise click.ClickException("No patents to compare on; load some into the database first.")
+
+    report = parity_report(load_embedding_model("torch"), load_embedding_model(backend), texts,
+                           batch_size=batch_size)
+    click.echo(f"{backend} vs torch on {report['texts']} descriptions:")
+    click.echo(f"  cosine similarity: mean {report['mean_cosine']:.5f}, 1st percentile "
+               f"{report['p01_cosine']:.5f}, min {report['min_cosine']:.5f}")
+    click.echo(f"  time: torch {report['reference_seconds']:.2f}s, {backend} "
+               f"{report['candidate_seconds']:.2f}s ({report['speedup']:.2f}x)")
+    if max_drift is not None and report["max_drift"] > max_drift:
+        raise click.ClickException(f"Drift {report['max_drift']:.5f} exceeds --max-drift {max_drift}.")
@@ -1,69 +1,195 @@
-import openpyxl
+import argparse
+import functools
 import json
-from transformers import pipeline
+import multiprocessing
+import os
+import time
+
+import openpyxl
 
 
 model_name = "google/pegasus-xsum"  # PEGASUS model is optimized for concise summaries
 
 
-summarizer = pipeline("summarization", model=model_name)
+filler_words = {"is", "the", "and", "a", "an", "of", "to", "in", "on", "for", "at", "by", "with", "from", "as"}
 
+# Loaded lazily, once per process (the main process or each pool worker).
+summarizer = None
+
+
+def load_summarizer(threads=None):
+    global summarizer
+    if summarizer is None:
+        from transformers import pipeline
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        summarizer = pipeline("summarization", model=model_name)
+    return summarizer
+
+
+def iter_descriptions(xlsx_file, start_row=2):
+    """
+    Stream (row number, description) pairs from the first column of the
+    active sheet, without loading the whole workbook into memory.
+    """
+    wb = openpyxl.load_workbook(xlsx_file, read_only=True)
+    try:
+        sheet = wb.active
+        for idx, row in enumerate(sheet.iter_rows(min_row=start_row, max_col=1, values_only=True), start=start_row):
+            yield idx, row[0] if row else None
+    finally:
+        wb.close()
+
+
+def count_rows(xlsx_file):
+    wb = openpyxl.load_workbook(xlsx_file, read_only=True)
+    try:
+        max_row = wb.active.max_row
+    finally:
+        wb.close()
+    return max_row - 1 if max_row else None  # Subtract 1 for the header row
+
+
+def make_title(summary_text):
+    cleaned_title_words = [word for word in summary_text.split() if word.lower() not in filler_words]
+    concise_title = ' '.join(cleaned_title_words)
+
+    if len(concise_title.split()) > 12:  # This is roughly 70 characters or fewer
+        concise_title = ' '.join(concise_title.split()[:12]) + "..."
+    return concise_title
+
+
+def summarize_batch(batch, batch_size=8):
+    """
+    Summarize a batch of (row number, description) pairs in one pipeline call.
+    Returns records with row, description and title, in input order. If the
+    batched call fails, rows are retried one by one so a bad row only
+    affects its own title.
+    """
+    model = load_summarizer()
+    texts = [description for _, description in batch if description]
+    titles = {}
+    if texts:
+        try:
+            summaries = model(texts, max_length=50, min_length=30, do_sample=False,
+                              truncation=True, batch_size=batch_size)
+            titles = dict(zip(texts, (make_title(summary['summary_text']) for summary in summaries)))
+        except Exception:
+            for text in texts:
+                try:
+                    summary = model(text, max_length=50, min_length=30, do_sample=False, truncation=True)
+                    titles[text] = make_title(summary[0]['summary_text'])
+                except Exception as e:
+                    titles[text] = f"Error generating summary: {e}"
+
+    return [{
+        'row': idx,
+        'description': description,
+        'title': titles[description] if description else "No description provided",
+    } for idx, description in batch]
+
+
+def iter_batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def read_checkpoint(checkpoint_file):
+    try:
+        with open(checkpoint_file) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(checkpoint_file, last_row, output_offset):
+    tmp_file = checkpoint_file + ".tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump({'last_row': last_row, 'output_offset': output_offset}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, checkpoint_file)
+
+
+def _init_worker(threads):
+    load_summarizer(threads)
+
+
+def read_and_assign_summary_title(xlsx_file, output_jsonl_file, batch_size=8, workers=1, resume=True):
+    """
+    Summarize every description in `xlsx_file` into a short title and append
+    {"row", "description", "title"} records to `output_jsonl_file` (JSON Lines).
+
+    Rows are read in streaming mode and summarized in batches of `batch_size`,
+    spread over `workers` processes. After each batch is written a checkpoint
+    (`<output>.checkpoint`) records the last row, so an interrupted run
+    resumes where it stopped instead of starting over from row 2.
+    """
+    checkpoint_file = output_jsonl_file + ".checkpoint"
+    checkpoint = read_checkpoint(checkpoint_file) if resume else None
+    start_row = checkpoint['last_row'] + 1 if checkpoint else 2
+
+    total_rows = count_rows(xlsx_file)
+    rows = iter_descriptions(xlsx_file, start_row=start_row)
+    batches = iter_batches(rows, batch_size)
+    summarize = functools.partial(summarize_batch, batch_size=batch_size)
+
+    pool = None
+    if workers > 1:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(threads,))
+        results = pool.imap(summarize, batches)
+    else:
+        results = map(summarize, batches)
+
+    with open(output_jsonl_file, 'a+b') as output:
+        # Drop anything written after the last checkpoint (e.g. a half-written batch).
+        output.truncate(checkpoint['output_offset'] if checkpoint else 0)
+        output.seek(0, os.SEEK_END)
+        if start_row > 2:
+            print(f"Resuming after row {start_row - 1}")
+
+        started = time.perf_counter()
+        processed = 0
+        try:
+            for records in results:
+                output.write(b"".join(
+                    json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n" for record in records
+                ))
+                output.flush()
+                os.fsync(output.fileno())
+                write_checkpoint(checkpoint_file, records[-1]['row'], output.tell())
+
+                processed += len(records)
+                done = records[-1]['row'] - 1
+                rate = processed / (time.perf_counter() - started)
+                if total_rows:
+                    print(f"Processing row {done}/{total_rows} ({done / total_rows * 100:.2f}% complete, {rate:.1f} rows/s)")
+                else:
+                    print(f"Processing row {done} ({rate:.1f} rows/s)")
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    print(f"Data has been saved to {output_jsonl_file}")
 
-filler_words = {"is", "the", "and", "a", "an", "of", "to", "in", "on", "for", "at", "by", "with", "from", "as"}
 
-def read_and_assign_summary_title(xlsx_file, output_json_file):
-    
-    wb = openpyxl.load_workbook(xlsx_file)
-    sheet = wb.active
-    
-    data = []
-    
-    
-    total_rows = sheet.max_row - 1  # Subtract 1 for the header row
-
-    
-    for idx, row in enumerate(sheet.iter_rows(min_row=2, max_col=1, values_only=True), start=2):  
-        description = row[0]
-        
-        
-        if description:
-            try:
-               
-                summary = summarizer(description, max_length=50, min_length=30, do_sample=False)
-                summary_text = summary[0]['summary_text']
-                
-                
-                cleaned_title_words = [word for word in summary_text.split() if word.lower() not in filler_words]
-                
-                
-                concise_title = ' '.join(cleaned_title_words)
-                
-               
-                if len(concise_title.split()) > 12:  # This is roughly 70 characters or fewer
-                    concise_title = ' '.join(concise_title.split()[:12]) + "..."
-                
-            except Exception as e:
-                concise_title = f"Error generating summary: {e}"
-        else:
-            concise_title = "No description provided"
-        
-        # Store the description and title in the list
-        data.append({
-            'description': description,
-            'title': concise_title
-        })
-        
-        
-        if (idx - 1) % 10 == 0:  # Print progress every 10 rows
-            progress = (idx - 1) / total_rows * 100
-            print(f"Processing row {idx - 1}/{total_rows} ({progress:.2f}% complete)")
-    
-    
-    with open(output_json_file, 'w') as json_file:
-        json.dump(data, json_file, indent=4)
-
-    print(f"Data has been saved to {output_json_file}")
-
-
-read_and_assign_summary_title('spi.xlsx', 'output_titles_and_descriptions.json')
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarize patent descriptions into short titles.")
+    parser.add_argument('xlsx_file', nargs='?', default='spi.xlsx')
+    parser.add_argument('output_jsonl_file', nargs='?', default='output_titles_and_descriptions.jsonl')
+    parser.add_argument('--batch-size', type=int, default=8, help="Descriptions per summarization batch.")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes, each with its own model.")
+    parser.add_argument('--no-resume', action='store_true', help="Ignore any checkpoint and start from row 2.")
+    args = parser.parse_args()
 
+    read_and_assign_summary_title(args.xlsx_file, args.output_jsonl_file, batch_size=args.batch_size,
+                                  workers=args.workers, resume=not args.no_resume)
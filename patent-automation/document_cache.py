@@ -0,0 +1,102 @@
+# document_cache.py
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import GeneratedDocument
+
+
+class DocumentCache:
+    """
+    Content-addressed cache of generated patent documents in the
+    `generated_documents` table.
+
+    Entries are keyed by a hash of everything that determines the output
+    (title, description, prompt template version, model and temperature),
+    expire `ttl` after they were generated, and the least recently used
+    entries are evicted beyond `max_entries`. Must be used inside an app context.
+    """
+
+    def __init__(self, ttl=timedelta(days=30), max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(title, description, prompt_version, model, temperature):
+        payload = json.dumps(
+            {
+                "title": title,
+                "description": description,
+                "prompt_version": prompt_version,
+                "model": model,
+                "temperature": temperature,
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Return the cached document for `key`, or None if absent or expired.
+        """
+        document = db.session.get(GeneratedDocument, key)
+        now = datetime.utcnow()
+        if document is not None and document.created_at < now - self.ttl:
+            db.session.delete(document)
+            db.session.commit()
+            document = None
+        if document is None:
+            self.misses += 1
+            return None
+        document.last_accessed_at = now
+        db.session.commit()
+        self.hits += 1
+        return document.content
+
+    def put(self, key, content, title, model, prompt_version):
+        now = datetime.utcnow()
+        document = db.session.get(GeneratedDocument, key)
+        if document is None:
+            document = GeneratedDocument(key=key, created_at=now)
+            db.session.add(document)
+        document.title = title[:255]
+        document.model = model
+        document.prompt_version = prompt_version
+        document.content = content
+        document.size_bytes = len(content.encode("utf-8"))
+        document.created_at = now
+        document.last_accessed_at = now
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker cached the same document concurrently.
+            db.session.rollback()
+            return
+        self._evict()
+
+    def _evict(self):
+        db.session.execute(delete(GeneratedDocument).where(GeneratedDocument.created_at < datetime.utcnow() - self.ttl))
+        excess = db.session.scalar(select(func.count()).select_from(GeneratedDocument)) - self.max_entries
+        if excess > 0:
+            oldest = db.session.scalars(
+                select(GeneratedDocument.key).order_by(GeneratedDocument.last_accessed_at).limit(excess)
+            ).all()
+            db.session.execute(delete(GeneratedDocument).where(GeneratedDocument.key.in_(oldest)))
+        db.session.commit()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": db.session.scalar(select(func.count()).select_from(GeneratedDocument)),
+            "bytes": db.session.scalar(select(func.coalesce(func.sum(GeneratedDocument.size_bytes), 0))),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl.total_seconds(),
+        }
@@ -0,0 +1,193 @@
+# embedding_backends.py
+import json
+import os
+import time
+
+import numpy as np
+
+# Ways to run the sentence embedding model on CPU. The int8 variants quantize the weights of
+# the linear layers dynamically; they are faster and slightly less accurate (see `flask embeddings parity`).
+EMBEDDING_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model-int8.onnx"
+# Settings of the SentenceTransformer the ONNX model was exported from, e.g. its max_seq_length.
+ONNX_CONFIG_FILE = "embedding_config.json"
+ONNX_OPSET = 14
+
+
+class TorchEmbedder:
+    """
+    The reference: SentenceTransformer running in PyTorch on the CPU,
+    optionally with its linear layers dynamically quantized to int8.
+    """
+
+    def __init__(self, model_name, threads=None, quantize=False):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = SentenceTransformer(model_name, device="cpu")
+        if quantize:
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def encode(self, texts, batch_size=32):
+        return self.model.encode(list(texts), batch_size=batch_size, convert_to_numpy=True)
+
+
+class OnnxEmbedder:
+    """
+    The model's transformer exported to ONNX (see export_onnx) and run with
+    ONNX Runtime, followed by the same mean pooling as SentenceTransformer.
+
+    The inference session is created on first use in each process: ONNX
+    Runtime's thread pool does not survive fork(), so a session created in
+    a gunicorn master would hang in its workers.
+    """
+
+    def __init__(self, model_path, threads=None):
+        from transformers import AutoTokenizer
+
+        self.model_path = model_path
+        self.threads = threads
+        self.tokenizer = AutoTokenizer.from_pretrained(os.path.dirname(model_path))
+        # Truncate where SentenceTransformer does (256 word pieces for all-MiniLM-L6-v2), not at the
+        # tokenizer's own limit, so long descriptions are embedded from the same text as with torch.
+        with open(os.path.join(os.path.dirname(model_path), ONNX_CONFIG_FILE)) as f:
+            self.max_seq_length = json.load(f)["max_seq_length"]
+        self._session = None
+        self._pid = None
+
+    def _get_session(self):
+        if self._pid != os.getpid():
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if self.threads:
+                options.intra_op_num_threads = self.threads
+                options.inter_op_num_threads = 1
+            self._session = onnxruntime.InferenceSession(
+                self.model_path, options, providers=["CPUExecutionProvider"]
+            )
+            self._pid = os.getpid()
+        return self._session
+
+    def encode(self, texts, batch_size=32):
+        session = self._get_session()
+        input_names = [model_input.name for model_input in session.get_inputs()]
+        texts = list(texts)
+        # Batch texts of similar length together to keep padding down, like SentenceTransformer.encode.
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        results = [None] * len(texts)
+        for start in range(0, len(texts), batch_size):
+            batch = order[start:start + batch_size]
+            tokens = self.tokenizer([texts[i] for i in batch], padding=True, truncation=True,
+                                    max_length=self.max_seq_length, return_tensors="np")
+            hidden = session.run(None, {name: tokens[name].astype("int64") for name in input_names})[0]
+            mask = tokens["attention_mask"][..., None].astype("float32")
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            for i, row in zip(batch, pooled):
+                results[i] = row
+        if not results:
+            return np.empty((0, 0), dtype="float32")
+        return np.stack(results).astype("float32", copy=False)
+
+
+def export_onnx(model_name, output_dir, quantize=False):
+    """
+    Export the transformer of SentenceTransformer `model_name`, with its
+    tokenizer and max_seq_length, to `output_dir`, and with `quantize` also
+    write an int8 dynamically quantized copy. Returns the path of the
+    requested model.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(output_dir, exist_ok=True)
+    model_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    config_path = os.path.join(output_dir, ONNX_CONFIG_FILE)
+    if not os.path.exists(config_path) or not os.path.exists(model_path):
+        model = SentenceTransformer(model_name, device="cpu")
+        with open(config_path, "w") as f:
+            json.dump({"model_name": model_name, "max_seq_length": model.max_seq_length}, f)
+    if not os.path.exists(model_path):
+        pooling = model[1].get_pooling_mode_str() if len(model) > 1 else "mean"
+        if pooling != "mean":
+            raise ValueError(f"Only mean pooling is supported for ONNX export, not '{pooling}'.")
+        model.tokenizer.save_pretrained(output_dir)
+        transformer = model[0].auto_model.eval()
+        dummy = model.tokenizer(["an example sentence"], return_tensors="pt")
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+        tmp_path = model_path + ".tmp"
+        with torch.no_grad():
+            torch.onnx.export(transformer, tuple(dummy[name] for name in input_names), tmp_path,
+                              input_names=input_names, output_names=["last_hidden_state"],
+                              dynamic_axes=dynamic_axes, opset_version=ONNX_OPSET)
+        os.replace(tmp_path, model_path)
+    if not quantize:
+        return model_path
+
+    int8_path = os.path.join(output_dir, ONNX_INT8_MODEL_FILE)
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        tmp_path = int8_path + ".tmp"
+        quantize_dynamic(model_path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, int8_path)
+    return int8_path
+
+
+def load_embedder(backend, model_name, onnx_dir, threads=None):
+    """
+    Create the embedder for `backend`; the ONNX backends export the model to
+    `onnx_dir` first if it is not there yet. Embedders have an
+    `encode(texts, batch_size)` method returning a float32 array.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}'. Expected one of: {', '.join(EMBEDDING_BACKENDS)}.")
+    if backend.startswith("torch"):
+        return TorchEmbedder(model_name, threads=threads, quantize=backend == "torch-int8")
+
+    quantize = backend == "onnx-int8"
+    model_path = os.path.join(onnx_dir, ONNX_INT8_MODEL_FILE if quantize else ONNX_MODEL_FILE)
+    if not os.path.exists(model_path) or not os.path.exists(os.path.join(onnx_dir, ONNX_CONFIG_FILE)):
+        print(f"Exporting {model_name} to {model_path}...")
+        model_path = export_onnx(model_name, onnx_dir, quantize=quantize)
+    return OnnxEmbedder(model_path, threads=threads)
+
+
+def _normalized(embeddings):
+    embeddings = np.asarray(embeddings, dtype="float32")
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def parity_report(reference, candidate, texts, batch_size=32):
+    """
+    Encode `texts` with both embedders and compare: the cosine similarity
+    between each pair of embeddings (1.0 means identical) and the time
+    each embedder took.
+    """
+    timings = {}
+    embeddings = {}
+    for name, embedder in (("reference", reference), ("candidate", candidate)):
+        embedder.encode(texts[:batch_size], batch_size=batch_size)  # Warm-up, not timed.
+        started = time.perf_counter()
+        embeddings[name] = _normalized(embedder.encode(texts, batch_size=batch_size))
+        timings[name] = time.perf_counter() - started
+
+    cosine = np.einsum("ij,ij->i", embeddings["reference"], embeddings["candidate"])
+    return {
+        "texts": len(texts),
+        "mean_cosine": float(cosine.mean()),
+        "min_cosine": float(cosine.min()),
+        "p01_cosine": float(np.percentile(cosine, 1)),
+        "max_drift": float(1 - cosine.min()),
+        "reference_seconds": timings["reference"],
+        "candidate_seconds": timings["candidate"],
+        "speedup": timings["reference"] / timings["candidate"] if timings["candidate"] > 0 else float("inf"),
+    }
@@ -0,0 +1,103 @@
+# embedding_batcher.py
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent single-text embedding requests into batched encodes.
+
+    Callers `submit()` a text and wait on the returned Future. A background
+    thread collects requests until `max_batch_size` texts are queued or the
+    oldest one has waited `max_wait_ms`, runs a single `encode_batch(texts)`
+    call and resolves every caller's Future with its row of the result.
+    """
+
+    def __init__(self, encode_batch, max_batch_size=32, max_wait_ms=5.0):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+        self._batches = 0
+        self._texts = 0
+        self._largest_batch = 0
+        self._encode_seconds = 0.0
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so each (gunicorn) worker process starts its own.
+        if self._pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._worker.is_alive():
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def submit(self, text):
+        """
+        Queue `text` for embedding; returns a Future resolving to its vector.
+        """
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            futures = [future for _, future in batch if future.set_running_or_notify_cancel()]
+            texts = [text for text, future in batch if future.running()]
+            if not texts:
+                continue
+            started = time.perf_counter()
+            try:
+                embeddings = self.encode_batch(texts)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, embedding in zip(futures, embeddings):
+                future.set_result(embedding)
+
+            with self._lock:
+                self._batches += 1
+                self._texts += len(texts)
+                self._largest_batch = max(self._largest_batch, len(texts))
+                self._encode_seconds += time.perf_counter() - started
+
+    def stats(self):
+        """
+        Tunables plus queue depth and batching counters for this process.
+        """
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "queue_depth": self._queue.qsize(),
+                "batches": self._batches,
+                "texts": self._texts,
+                "mean_batch_size": self._texts / self._batches if self._batches else 0.0,
+                "largest_batch": self._largest_batch,
+                "encode_seconds": self._encode_seconds,
+            }
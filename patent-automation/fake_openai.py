@@ -0,0 +1,94 @@
+# fake_openai.py
+"""
+A local stand-in for the OpenAI chat completions API, for testing generation
+without network access or API costs.
+
+    python fake_openai.py --port 8001 --words 400 --token-delay 0.01
+    OPENAI_API_BASE=http://localhost:8001/v1 OPENAI_API_KEY=fake flask run
+
+Completions are deterministic filler text of `--words` words, streamed one
+word per chunk when the client asks for stream=True. `--rate-limit-every N`
+answers every Nth request with HTTP 429 so retry handling can be exercised.
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+
+from flask import Flask, Response, jsonify, request
+
+app = Flask(__name__)
+settings = {"words": 400, "token_delay": 0.0, "latency": 0.0, "rate_limit_every": 0}
+request_counter = itertools.count(1)
+counter_lock = threading.Lock()
+
+FILLER = ("the claimed system comprises a controller coupled to a sensor array configured to "
+          "measure and adjust operating parameters in response to detected conditions").split()
+
+
+def completion_words(messages):
+    prompt = " ".join(message.get("content", "") for message in messages)
+    offset = len(prompt) % len(FILLER)
+    return [FILLER[(offset + i) % len(FILLER)] for i in range(settings["words"])]
+
+
+@app.route("/v1/chat/completions", methods=["POST"])
+def chat_completions():
+    with counter_lock:
+        number = next(request_counter)
+    every = settings["rate_limit_every"]
+    if every and number % every == 0:
+        return jsonify({"error": {"message": "Rate limit reached (fake).", "type": "requests",
+                                  "code": "rate_limit_exceeded"}}), 429
+
+    body = request.get_json()
+    model = body.get("model", "gpt-4")
+    words = completion_words(body.get("messages", []))
+    completion_id = f"chatcmpl-fake-{number}"
+    time.sleep(settings["latency"])
+
+    if not body.get("stream"):
+        time.sleep(settings["token_delay"] * len(words))
+        return jsonify({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": " ".join(words)}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+        })
+
+    def chunks():
+        for i, word in enumerate(words):
+            time.sleep(settings["token_delay"])
+            delta = {"content": word if i == 0 else f" {word}"}
+            if i == 0:
+                delta["role"] = "assistant"
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                       "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            yield f"data: {json.dumps(payload)}\n\n"
+        payload = {"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                   "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        yield f"data: {json.dumps(payload)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return Response(chunks(), mimetype="text/event-stream")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--words", type=int, default=settings["words"], help="Words per completion.")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between streamed words.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the first word.")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Answer every Nth request with 429.")
+    args = parser.parse_args()
+    settings.update(words=args.words, token_delay=args.token_delay, latency=args.latency,
+                    rate_limit_every=args.rate_limit_every)
+    app.run(port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+# file_locks.py
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, single worker only.
+    fcntl = None
+
+
+def lock_file(path, exclusive=True, blocking=True):
+    """
+    Open and flock the lock file at `path`, shared by every process using
+    the same path; closing the returned handle releases the lock. Returns
+    None if `blocking` is False and the lock is taken.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    handle = open(path, "a")
+    if fcntl is not None:
+        mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        try:
+            fcntl.flock(handle, mode if blocking else mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            return None
+    return handle
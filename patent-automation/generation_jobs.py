@@ -0,0 +1,356 @@
+# generation_jobs.py
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobLimitError(Exception):
+    """
+    Raised when a job cannot be queued: the queue is full or the caller's
+    key already has its maximum number of unfinished jobs.
+    """
+
+
+class JobStore:
+    """
+    Generation jobs on disk, so that every worker process can answer status
+    and stream requests for a job, whichever worker runs it.
+
+    Each job has a state file `<id>.json`, replaced atomically on every
+    status change, and a chunk log `<id>.chunks` of JSON-encoded text
+    chunks, one per line, appended as the model streams them. Chunks are
+    always written before the state that follows them, so a reader that
+    sees a finished state and then reads the log has every chunk.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id, suffix):
+        # Job ids come from URLs; only hex ids (see GenerationJob) name files.
+        if not job_id or any(c not in "0123456789abcdef" for c in job_id):
+            return None
+        return os.path.join(self.directory, f"{job_id}{suffix}")
+
+    def save(self, job_id, state):
+        path = self._path(job_id, ".json")
+        tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def load(self, job_id):
+        """
+        The job's saved state, or None if there is no such job.
+        """
+        path = self._path(job_id, ".json")
+        if path is None:
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def append_chunk(self, job_id, text):
+        # One write per line with O_APPEND, so readers never see a chunk half written.
+        fd = os.open(self._path(job_id, ".chunks"), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(text) + "\n").encode("utf-8"))
+        finally:
+            os.close(fd)
+
+    def read_chunks(self, job_id, offset=0):
+        """
+        The complete chunks logged past byte `offset`, and the offset after them.
+        """
+        try:
+            with open(self._path(job_id, ".chunks"), "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+        end = data.rfind(b"\n") + 1
+        return [json.loads(line) for line in data[:end].splitlines()], offset + end
+
+    def remove(self, job_id):
+        for suffix in (".json", ".chunks"):
+            path = self._path(job_id, suffix)
+            try:
+                if path is not None:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def prune(self, cutoff):
+        """
+        Remove jobs last updated before `cutoff` (a timestamp), including
+        those left unfinished by a worker that died.
+        """
+        for name in os.listdir(self.directory):
+            job_id, suffix = os.path.splitext(name)
+            if suffix == ".json":
+                try:
+                    if os.path.getmtime(os.path.join(self.directory, name)) < cutoff:
+                        self.remove(job_id)
+                except FileNotFoundError:
+                    pass
+
+
+class GenerationJob:
+    """
+    A queued or running generation. Text is appended chunk by chunk as the
+    model streams it, so readers can follow along or wait for the result.
+    With a `store`, every chunk and status change is also written to it for
+    the other workers (see StoredJob).
+    """
+
+    def __init__(self, key, store=None):
+        self.id = uuid.uuid4().hex
+        self.store = store
+        self.key = key
+        self.status = "queued"
+        self.chunks = []
+        self.result = None
+        self.error = None
+        self.attempts = 0
+        self.created_at = time.time()
+        self.finished_at = None
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    def _update(self, **fields):
+        with self._cond:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            if self.finished and self.finished_at is None:
+                self.finished_at = time.time()
+            if self.store is not None:
+                self.store.save(self.id, self.to_dict())
+            self._cond.notify_all()
+
+    def emit(self, text):
+        """
+        Append a streamed chunk of generated text.
+        """
+        if text:
+            with self._cond:
+                if self.store is not None:
+                    self.store.append_chunk(self.id, text)
+                self.chunks.append(text)
+                self._cond.notify_all()
+
+    def follow(self, start=0, timeout=15.0):
+        """
+        Yield (index, chunk) pairs from `start` until the job finishes.
+        Yields (None, None) after `timeout` seconds without new text so that
+        callers can send keep-alives.
+        """
+        index = start
+        while True:
+            with self._cond:
+                if index >= len(self.chunks) and not self.finished:
+                    self._cond.wait(timeout)
+                pending = self.chunks[index:]
+                finished = self.finished
+            for chunk in pending:
+                yield index, chunk
+                index += 1
+            if finished and index >= len(self.chunks):
+                return
+            if not pending:
+                yield None, None
+
+    def to_dict(self, include_result=True):
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "attempts": self.attempts,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == "done" and include_result:
+            data["generated_patent_section"] = self.result
+        if self.status == "error":
+            data["error"] = self.error
+        return data
+
+
+class StoredJob:
+    """
+    Read-only view of a job run by another worker, read from its JobStore
+    files; `follow` polls the chunk log every `poll_seconds`.
+    """
+
+    def __init__(self, store, state, poll_seconds=0.2):
+        self.store = store
+        self.state = state
+        self.id = state["job_id"]
+        self.poll_seconds = poll_seconds
+
+    @property
+    def status(self):
+        return self.state["status"]
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    def follow(self, start=0, timeout=15.0):
+        """
+        Yield (index, chunk) pairs from `start` until the job finishes, and
+        (None, None) after `timeout` seconds without new text, like
+        GenerationJob.follow.
+        """
+        index, offset = 0, 0
+        idle_since = time.monotonic()
+        while True:
+            # State before chunks: once it reads finished, the log is complete.
+            state = self.store.load(self.id)
+            if state is None:  # Pruned.
+                return
+            self.state = state
+            chunks, offset = self.store.read_chunks(self.id, offset)
+            for chunk in chunks:
+                if index >= start:
+                    yield index, chunk
+                index += 1
+            if self.finished and not chunks:
+                return
+            if chunks:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since >= timeout:
+                idle_since = time.monotonic()
+                yield None, None
+            else:
+                time.sleep(self.poll_seconds)
+
+    def to_dict(self, include_result=True):
+        if include_result:
+            return dict(self.state)
+        return {name: value for name, value in self.state.items() if name != "generated_patent_section"}
+
+
+class GenerationJobManager:
+    """
+    Runs generation jobs on a bounded thread pool.
+
+    `submit(key, work)` queues `work(emit)`, which should stream text through
+    `emit` and return the complete document. At most `max_jobs_per_key`
+    unfinished jobs are allowed per key and `max_pending` overall. Exceptions
+    listed in `retry_on` raised before any text was streamed are retried with
+    exponential backoff and jitter (`retry_on` may also be a callable returning
+    the tuple, for exception classes from a lazily imported package), unless
+    the job was submitted with retry=False because `work` retries on its own;
+    `describe_error` turns a failure into the message stored on the job.
+    Finished jobs are kept for `job_ttl` seconds.
+
+    With `store_dir`, jobs are also kept in a JobStore there, so that
+    `get()` finds jobs run by any worker sharing the directory (gunicorn
+    runs several); queue limits still apply per worker.
+    """
+
+    def __init__(self, max_workers=4, max_pending=64, max_jobs_per_key=2, retry_on=(),
+                 max_retries=4, backoff_seconds=2.0, job_ttl=3600, describe_error=str, store_dir=None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_jobs_per_key = max_jobs_per_key
+        self.retry_on = retry_on if callable(retry_on) else tuple(retry_on)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.job_ttl = job_ttl
+        self.describe_error = describe_error
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="generation")
+        self.store = JobStore(store_dir) if store_dir else None
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._store_pruned_at = 0.0
+
+    def _prune(self):
+        cutoff = time.time() - self.job_ttl
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+        # Every worker prunes the shared directory, so at most once a minute each.
+        if self.store is not None and time.time() - self._store_pruned_at > 60:
+            self._store_pruned_at = time.time()
+            self.store.prune(cutoff)
+
+    def submit(self, key, work, retry=True):
+        with self._lock:
+            self._prune()
+            unfinished = [job for job in self._jobs.values() if not job.finished]
+            if len(unfinished) >= self.max_pending:
+                raise JobLimitError("The generation queue is full. Please try again later.")
+            if sum(job.key == key for job in unfinished) >= self.max_jobs_per_key:
+                raise JobLimitError(
+                    f"At most {self.max_jobs_per_key} generation jobs may run at once per client."
+                )
+            job = GenerationJob(key, self.store)
+            self._jobs[job.id] = job
+        job._update()  # Saves the queued job, so other workers find it right away.
+        self._executor.submit(self._run, job, work, retry)
+        return job
+
+    def add_finished(self, key, result):
+        """
+        Register an already finished job, e.g. for a cached document, so
+        clients can poll or stream it like any other job.
+        """
+        job = GenerationJob(key, self.store)
+        job.emit(result)
+        job._update(status="done", result=result)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        """
+        The job with `job_id`: this worker's own, or another worker's read
+        from the store. None if there is no such job.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None or self.store is None:
+            return job
+        state = self.store.load(job_id)
+        return StoredJob(self.store, state) if state is not None else None
+
+    def _retryable(self, error):
+        retry_on = self.retry_on() if callable(self.retry_on) else self.retry_on
+        return isinstance(error, tuple(retry_on))
+
+    def _run(self, job, work, retry):
+        job._update(status="running")
+        while True:
+            job._update(attempts=job.attempts + 1)
+            try:
+                result = work(job.emit)
+            except Exception as e:
+                if not retry or not self._retryable(e) or job.chunks or job.attempts > self.max_retries:
+                    job._update(status="error", error=self.describe_error(e))
+                    return
+                delay = self.backoff_seconds * 2 ** (job.attempts - 1)
+                time.sleep(delay + random.uniform(0, delay / 2))
+            else:
+                job._update(status="done", result=result)
+                return
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "max_jobs_per_key": self.max_jobs_per_key,
+            **{status: statuses.count(status) for status in ("queued", "running", "done", "error")},
+        }
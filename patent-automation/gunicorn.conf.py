@@ -0,0 +1,44 @@
+# gunicorn.conf.py
+"""
+Production server settings:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The app is imported and its models warmed up once in the master process;
+workers are forked afterwards and share the loaded model weights and the
+memory-mapped FAISS snapshot copy-on-write instead of each loading their own.
+Point PROMETHEUS_MULTIPROC_DIR at an empty directory for /metrics to cover
+every worker rather than just the one answering.
+"""
+import gc
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# Threads keep SSE streams and queued generations from tying up a whole worker.
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+preload_app = True
+
+
+def when_ready(server):
+    # Runs in the master after the app is preloaded and before any worker is forked.
+    # Only load here: encoding in the master would start the embedding batcher's thread
+    # and torch's thread pools, which do not survive fork().
+    from operations import warm_up
+
+    for name, seconds in warm_up().items():
+        server.log.info("Loaded %s in %.2fs", name, seconds)
+    # Move everything loaded so far out of the garbage collector's reach, so collections
+    # in the workers do not write to (and thereby copy) the shared pages.
+    gc.freeze()
+
+
+def child_exit(server, worker):
+    # With PROMETHEUS_MULTIPROC_DIR set, /metrics adds up every worker's metric files;
+    # drop the live gauges of a worker that exited.
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
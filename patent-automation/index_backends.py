@@ -0,0 +1,178 @@
+# index_backends.py
+import math
+import time
+
+import numpy as np
+
+# faiss is imported inside the functions that use it, so that reading the constants below
+# (e.g. for CLI option choices) does not load it.
+
+# Supported FAISS backends for the snapshot index. "auto" picks one by corpus size.
+# sq8 and fp16 are exhaustive scans over scalar-quantized vectors (1 or 2 bytes per dimension
+# instead of 4); they are only used when asked for explicitly.
+BACKENDS = ("flat", "hnsw", "ivfpq", "sq8", "fp16")
+
+# Backends whose scores are approximate. Their candidates are re-scored exactly from the
+# snapshot's float32 vectors, so similarity thresholds mean the same on every backend.
+RERANK_BACKENDS = ("ivfpq", "sq8", "fp16")
+
+# Corpus sizes at which "auto" switches from exact search to HNSW, and from HNSW to IVF-PQ.
+HNSW_MIN_VECTORS = 50_000
+IVFPQ_MIN_VECTORS = 1_000_000
+
+# An IVF-PQ index is retrained once the corpus outgrows its coarse quantizer by this factor.
+IVFPQ_RETRAIN_GROWTH = 4
+
+HNSW_M = 32
+PQ_BITS = 8
+IVFPQ_MIN_VECTORS_TO_TRAIN = 39 * 2 ** PQ_BITS
+MAX_TRAINING_VECTORS = 100_000
+
+# Candidate values tried by `calibrate`, cheapest first.
+SEARCH_PARAMETER_SWEEP = {
+    "hnsw": ("efSearch", (16, 32, 48, 64, 96, 128, 192, 256, 384, 512)),
+    "ivfpq": ("nprobe", (1, 2, 4, 8, 12, 16, 24, 32, 48, 64, 96, 128, 256)),
+}
+
+
+def choose_backend(ntotal, backend="auto"):
+    """
+    Resolve "auto" to a concrete backend name for a corpus of `ntotal` vectors.
+    """
+    if backend != "auto":
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown FAISS backend '{backend}'. Expected one of: auto, {', '.join(BACKENDS)}.")
+        if backend == "ivfpq" and ntotal < IVFPQ_MIN_VECTORS_TO_TRAIN:
+            print(f"Warning: {ntotal} vectors are too few to train IVF-PQ; using the flat index.")
+            return "flat"
+        return backend
+    if ntotal >= IVFPQ_MIN_VECTORS:
+        return "ivfpq"
+    if ntotal >= HNSW_MIN_VECTORS:
+        return "hnsw"
+    return "flat"
+
+
+def mmap_flags(backend):
+    """
+    read_index flags that memory-map a snapshot of the given backend.
+    """
+    import faiss
+    return faiss.IO_FLAG_MMAP if backend == "ivfpq" else faiss.IO_FLAG_MMAP_IFC
+
+
+def needs_rebuild(backend, current_backend, trained_ntotal, ntotal):
+    """
+    True if a snapshot of `current_backend` cannot simply absorb new vectors:
+    either the backend changes, or an IVF-PQ quantizer is stale for `ntotal`.
+    """
+    if backend != current_backend:
+        return True
+    return backend == "ivfpq" and ntotal > IVFPQ_RETRAIN_GROWTH * max(trained_ntotal, 1)
+
+
+def build_index(backend, dimension, vectors):
+    """
+    Create an empty index of `backend`, trained on a sample of `vectors`
+    (normalized float32, shape (n, dimension)) where training is needed.
+    """
+    import faiss
+    if backend == "flat":
+        return faiss.IndexFlatIP(dimension)
+    if backend == "hnsw":
+        return faiss.IndexHNSWFlat(dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    if backend in ("sq8", "fp16"):
+        qtype = faiss.ScalarQuantizer.QT_8bit if backend == "sq8" else faiss.ScalarQuantizer.QT_fp16
+        index = faiss.IndexScalarQuantizer(dimension, qtype, faiss.METRIC_INNER_PRODUCT)
+        # sq8 learns each dimension's value range; fp16 needs no training.
+        index.train(_training_sample(vectors, MAX_TRAINING_VECTORS))
+        return index
+    if backend != "ivfpq":
+        raise ValueError(f"Unknown FAISS backend '{backend}'.")
+
+    ntotal = len(vectors)
+    # ~4 * sqrt(n) lists, with at least 39 training points per centroid.
+    nlist = max(1, min(int(4 * math.sqrt(ntotal)), ntotal // 39))
+    sub_quantizers = next(m for m in (48, 32, 24, 16, 12, 8, 4, 2, 1) if dimension % m == 0)
+    quantizer = faiss.IndexFlatIP(dimension)
+    index = faiss.IndexIVFPQ(quantizer, dimension, nlist, sub_quantizers, PQ_BITS, faiss.METRIC_INNER_PRODUCT)
+
+    index.train(_training_sample(vectors, min(max(nlist * 256, 2 ** PQ_BITS * 39), MAX_TRAINING_VECTORS)))
+    return index
+
+
+def _training_sample(vectors, size):
+    rng = np.random.default_rng(0)
+    sample = vectors[np.sort(rng.choice(len(vectors), size=min(size, len(vectors)), replace=False))]
+    return np.ascontiguousarray(sample, dtype="float32")
+
+
+def set_search_parameters(index, params):
+    """
+    Apply search-time parameters such as {"efSearch": 64} or {"nprobe": 16}.
+    """
+    import faiss
+    space = faiss.ParameterSpace()
+    for name, value in (params or {}).items():
+        space.set_index_parameter(index, name, value)
+
+
+def rerank(queries, vectors, positions, k):
+    """
+    Score the candidate rows `positions` (n, candidates) of `vectors`
+    exactly against `queries` and keep the best `k` per query. Returns
+    (similarities, positions) like Index.search, with -1 for empty slots.
+    """
+    valid = positions >= 0
+    # Fancy indexing a memory-mapped array reads just the candidate rows.
+    candidates = vectors[np.maximum(positions, 0).ravel()].reshape(*positions.shape, vectors.shape[1])
+    sims = np.einsum("nd,ncd->nc", queries, candidates)
+    sims[~valid] = -np.inf
+    order = np.argsort(-sims, axis=1, kind="stable")[:, :k]
+    sims = np.take_along_axis(sims, order, axis=1)
+    positions = np.where(np.isfinite(sims), np.take_along_axis(positions, order, axis=1), -1)
+    return sims.astype("float32", copy=False), positions
+
+
+def calibrate(index, backend, vectors, k=5, target_recall=0.95, num_queries=200, rerank_factor=1):
+    """
+    Pick the cheapest search parameter whose recall@k against exact search
+    reaches `target_recall`, using stored vectors as sample queries. Each
+    query's own vector is left out of both result lists, as it would match
+    for free. RERANK_BACKENDS are measured as served: `rerank_factor`
+    times more candidates, re-scored exactly.
+    Returns (params, report) where report lists (value, recall, ms/query).
+    """
+    import faiss
+    if backend not in SEARCH_PARAMETER_SWEEP or len(vectors) < 2:
+        return {}, []
+
+    rng = np.random.default_rng(1)
+    ntotal = len(vectors)
+    k = min(k, ntotal - 1)
+    query_positions = np.sort(rng.choice(ntotal, size=min(num_queries, ntotal), replace=False))
+    queries = np.ascontiguousarray(vectors[query_positions], dtype="float32")
+
+    def without_self(results):
+        return [[position for position in row if position != own][:k] for row, own in zip(results, query_positions)]
+
+    # Exact baseline straight from the (memory-mapped) vectors, without copying them into a flat index.
+    _, truth = faiss.knn(queries, vectors, k + 1, metric=faiss.METRIC_INNER_PRODUCT)
+    truth = without_self(truth)
+    candidates = min(max((k + 1) * rerank_factor, k + 1), ntotal) if backend in RERANK_BACKENDS else k + 1
+
+    name, values = SEARCH_PARAMETER_SWEEP[backend]
+    report = []
+    for value in values:
+        set_search_parameters(index, {name: value})
+        started = time.perf_counter()
+        _, found = index.search(queries, candidates)
+        if backend in RERANK_BACKENDS:
+            _, found = rerank(queries, vectors, found, k + 1)
+        latency_ms = (time.perf_counter() - started) * 1000 / len(queries)
+        recall = np.mean([len(set(t) & set(f)) / k for t, f in zip(truth, without_self(found))])
+        report.append((value, float(recall), latency_ms))
+        if recall >= target_recall:
+            return {name: value}, report
+    # Target not reachable within the sweep: settle for the most accurate setting.
+    return {name: values[-1]}, report
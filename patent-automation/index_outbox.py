@@ -0,0 +1,131 @@
+# index_outbox.py
+import os
+import threading
+import time
+
+from sqlalchemy import delete, func, select
+
+from extensions import db
+from file_locks import lock_file
+from models import IndexOutbox, Patent
+
+
+class IndexOutboxApplier:
+    """
+    Adds committed patents to the FAISS and keyword indexes through an
+    outbox table, so the database and the indexes cannot drift apart.
+
+    /submit inserts the patent and an IndexOutbox row in one transaction,
+    then calls `drain()`: pending rows are embedded in one batch, appended
+    by `apply_patents(patent_ids, titles, descriptions)` and deleted. One
+    process drains at a time (a file lock), and every drain takes all
+    pending rows, so concurrent submits share a single batched encode.
+
+    Each worker also runs a background thread that every `interval`
+    seconds drains rows left behind by a request that failed or a worker
+    that died after its commit, and calls `sync()` to replay the other
+    workers' appends, so all workers converge on the same index position.
+
+    A worker dying between the append and the delete makes the next drain
+    append those patents again. Searches keep each patent's best match and
+    search wider when duplicate vectors leave fewer distinct patents than
+    asked for. Anything else appending to the index (`flask index
+    backfill`) takes the same lock.
+    """
+
+    def __init__(self, apply_patents, sync, lock_path, interval=2.0, batch_size=256):
+        self.apply_patents = apply_patents
+        self.sync = sync
+        self.lock_path = lock_path
+        self.interval = interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+        self._applied = 0
+        self._drains = 0
+        self._errors = 0
+
+    def ensure_running(self, app):
+        """
+        Start this process's background thread for `app` if not running yet.
+        """
+        # Threads do not survive fork(), so each (gunicorn) worker process starts its own.
+        if self._pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._worker.is_alive():
+                worker = threading.Thread(target=self._run, args=(app,), name="index-outbox", daemon=True)
+                worker.start()
+                # Publish the pid last: the unlocked check above must never see it with no thread.
+                self._worker, self._pid = worker, os.getpid()
+
+    def drain(self, blocking=True, chunk_size=None, **apply_options):
+        """
+        Apply every pending outbox row, `chunk_size` rows (default: the
+        applier's batch_size) at a time; `apply_options` are passed on to
+        `apply_patents`. Needs an app context. Returns the number of
+        patents applied, or None if `blocking` is False and another drain
+        is in progress.
+        """
+        chunk_size = chunk_size or self.batch_size
+        handle = lock_file(self.lock_path, blocking=blocking)
+        if handle is None:
+            return None
+        applied = 0
+        with handle:
+            try:
+                while True:
+                    # Rows of patents deleted meanwhile come back with no title and are just dropped.
+                    rows = db.session.execute(
+                        select(IndexOutbox.id, Patent.id.label("patent_id"), Patent.title, Patent.description)
+                        .outerjoin(Patent, Patent.id == IndexOutbox.patent_id)
+                        .order_by(IndexOutbox.id)
+                        .limit(chunk_size)
+                    ).all()
+                    if not rows:
+                        db.session.commit()
+                        break
+                    patents = [row for row in rows if row.patent_id is not None]
+                    if patents:
+                        self.apply_patents([row.patent_id for row in patents], [row.title for row in patents],
+                                           [row.description for row in patents], **apply_options)
+                    db.session.execute(delete(IndexOutbox).where(IndexOutbox.id.in_([row.id for row in rows])))
+                    db.session.commit()
+                    applied += len(patents)
+                    if len(rows) < chunk_size:
+                        break
+            except Exception:
+                db.session.rollback()
+                raise
+        with self._lock:
+            self._drains += 1
+            self._applied += applied
+        return applied
+
+    def pending(self):
+        """
+        Number of outbox rows not applied yet. Needs an app context.
+        """
+        return db.session.scalar(select(func.count()).select_from(IndexOutbox))
+
+    def _run(self, app):
+        while True:
+            time.sleep(self.interval)
+            with app.app_context():
+                try:
+                    self.drain(blocking=False)
+                    self.sync()
+                except Exception as e:
+                    with self._lock:
+                        self._errors += 1
+                    print(f"Warning: applying the index outbox failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "drains": self._drains,
+                "patents_applied": self._applied,
+                "errors": self._errors,
+                "background_thread": self._pid == os.getpid() and self._worker.is_alive(),
+            }
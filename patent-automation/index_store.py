@@ -0,0 +1,486 @@
+# index_store.py
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+from array import array
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+
+from file_locks import lock_file
+from index_backends import (
+    RERANK_BACKENDS,
+    build_index,
+    calibrate,
+    choose_backend,
+    mmap_flags,
+    needs_rebuild,
+    rerank,
+    set_search_parameters,
+)
+
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = "index.lock"
+CHECKPOINT_LOCK_FILE = "checkpoint.lock"
+# Vectors copied into a new snapshot, and added to its index, per step.
+CHECKPOINT_CHUNK_ROWS = 65536
+
+
+class ReadWriteLock:
+    """
+    Any number of readers or a single writer. A waiting writer holds off
+    new readers, so a steady stream of searches cannot starve an append.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def reading(self):
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class IndexStore:
+    """
+    Persistent FAISS index shared by every worker process.
+
+    The last snapshot (index + patent id map) is memory-mapped read-only, so
+    all workers share the same pages. Vectors added after the snapshot are
+    appended to a write-ahead log and kept in a small in-memory delta index;
+    every worker replays the log tail before searching. Once the delta grows
+    past `checkpoint_every` vectors it is folded into a new snapshot by a
+    separate process (see `add()`), never inside a worker serving requests.
+
+    Each snapshot also keeps the raw float32 vectors, so the snapshot index
+    can be rebuilt as a different backend (flat, HNSW or IVF-PQ, see
+    index_backends.py) when the corpus grows, without re-embedding anything.
+    Backends that store compressed vectors (sq8, fp16, ivfpq) fetch
+    `rerank_factor` times more candidates than asked for and re-score them
+    exactly from those memory-mapped vectors, of which only the candidate
+    rows are read.
+
+    Searches share a read lock on the in-memory indexes; only swapping in a
+    new snapshot and adding replayed log records to the delta take it
+    exclusively. Appending to the log (and its fsync) happens outside it,
+    so searches never wait on another request's disk write.
+    """
+
+    def __init__(self, directory, dimension, checkpoint_every=10000, backend="auto", target_recall=0.95,
+                 rerank_factor=4):
+        self.directory = directory
+        self.dimension = dimension
+        self.checkpoint_every = checkpoint_every
+        self.backend = backend
+        self.target_recall = target_recall
+        self.rerank_factor = rerank_factor
+        self.record = np.dtype([("patent_id", "<i8"), ("vector", "<f4", (dimension,))])
+        # Serializes reloads and log replays in this process; searches only take `_rw`.
+        self._lock = threading.Lock()
+        self._rw = ReadWriteLock()
+        # Bumped whenever this process sees the indexed vectors change.
+        self.generation = 0
+        self._checkpointer = None
+        os.makedirs(directory, exist_ok=True)
+        with self._file_lock(exclusive=False):
+            self._load()
+
+    # --- Paths and locking ---
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _snapshot_files(self, version):
+        return (self._path(f"faiss-{version}.index"),
+                self._path(f"ids-{version}.npy"),
+                self._path(f"vectors-{version}.npy"),
+                self._path(f"wal-{version}.log"))
+
+    def _file_lock(self, exclusive, name=LOCK_FILE, blocking=True):
+        """
+        Open and flock one of the store's lock files; closing the handle
+        releases it. Returns None if `blocking` is False and it is taken.
+        """
+        return lock_file(self._path(name), exclusive=exclusive, blocking=blocking)
+
+    def _read_manifest(self):
+        try:
+            with open(self._path(MANIFEST_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"version": 0}
+
+    @staticmethod
+    def _write_synced(path, write):
+        with open(path, "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _atomic_write(self, path, write):
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        self._write_synced(tmp_path, write)
+        os.replace(tmp_path, path)
+
+    # --- Loading ---
+
+    def _load(self):
+        """
+        Memory-map the current snapshot and replay its write-ahead log.
+        Callers must hold the file lock.
+        """
+        manifest = self._read_manifest()
+        version = manifest["version"]
+        index_path, ids_path, vectors_path, wal_path = self._snapshot_files(version)
+        if version and os.path.exists(index_path):
+            base_index = faiss.read_index(index_path, mmap_flags(manifest.get("backend", "flat")))
+            set_search_parameters(base_index, manifest.get("search_params"))
+            base_ids = np.load(ids_path, mmap_mode="r")
+            base_vectors = np.load(vectors_path, mmap_mode="r")
+        else:
+            base_index = faiss.IndexFlatIP(self.dimension)
+            base_ids = np.empty(0, dtype="int64")
+            base_vectors = np.empty((0, self.dimension), dtype="float32")
+        # Build the new delta before swapping, so searches never see the snapshot without its log.
+        delta_index = faiss.IndexFlatIP(self.dimension)
+        delta_ids = array("q")
+        records = self._read_wal(wal_path, 0)
+        if len(records):
+            delta_index.add(np.ascontiguousarray(records["vector"], dtype="float32"))
+            delta_ids.extend(records["patent_id"].tolist())
+        with self._rw.writing():
+            self.manifest, self.version = manifest, version
+            self.base_index, self.base_ids, self.base_vectors = base_index, base_ids, base_vectors
+            self.delta_index, self.delta_ids = delta_index, delta_ids
+            self.wal_offset = len(records) * self.record.itemsize
+            self.generation += 1
+
+    def _read_wal(self, wal_path, offset):
+        """
+        The complete log records of `wal_path` past byte `offset`; a record
+        still being written is left for the next read.
+        """
+        try:
+            with open(wal_path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:  # Removed by a checkpoint; the next refresh loads its snapshot.
+            data = b""
+        return np.frombuffer(data, dtype=self.record, count=len(data) // self.record.itemsize)
+
+    def _replay_wal(self):
+        """
+        Add every complete log record past `wal_offset` to the delta index.
+        Callers must hold `_lock`.
+        """
+        records = self._read_wal(self._snapshot_files(self.version)[3], self.wal_offset)
+        if len(records) == 0:
+            return
+        vectors = np.ascontiguousarray(records["vector"], dtype="float32")
+        with self._rw.writing():
+            self.delta_index.add(vectors)
+            self.delta_ids.extend(records["patent_id"].tolist())
+            self.wal_offset += len(records) * self.record.itemsize
+            self.generation += 1
+
+    def refresh(self):
+        """
+        Pick up snapshots and log records written by other workers.
+        """
+        with self._lock:
+            # The manifest is replaced atomically; only loading a snapshot needs the file lock.
+            if self._read_manifest()["version"] != self.version:
+                with self._file_lock(exclusive=False):
+                    self._load()
+            else:
+                self._replay_wal()
+
+    @property
+    def position(self):
+        """
+        Where this process has read up to: the snapshot version and the
+        write-ahead log offset. Workers that have caught up with each
+        other's writes report the same position.
+        """
+        return {"version": self.version, "wal_offset": self.wal_offset}
+
+    # --- Writing ---
+
+    @property
+    def ntotal(self):
+        return self.base_index.ntotal + self.delta_index.ntotal
+
+    def patent_ids(self):
+        """
+        Sorted array of the distinct patent ids in the store.
+        """
+        with self._rw.reading():
+            base_ids, delta_ids = self.base_ids, np.array(self.delta_ids, dtype="int64")
+        return np.union1d(np.asarray(base_ids), delta_ids)
+
+    def add(self, patent_ids, embeddings, checkpoint=True):
+        """
+        Durably append normalized embeddings (n, dimension) for `patent_ids`.
+        Pass checkpoint=False during bulk loads and call `checkpoint()` once
+        at the end instead of re-snapshotting every `checkpoint_every` rows.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype="float32").reshape(-1, self.dimension)
+        records = np.empty(len(embeddings), dtype=self.record)
+        records["patent_id"] = patent_ids
+        records["vector"] = embeddings
+        payload = records.tobytes()
+        # Append to the log of the current snapshot, whether or not this process has loaded it yet;
+        # the exclusive file lock keeps a checkpoint from publishing a new one meanwhile.
+        with self._file_lock(exclusive=True):
+            wal_path = self._snapshot_files(self._read_manifest()["version"])[3]
+            fd = os.open(wal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                # Drop a partial record left by an append that died midway (crash, full disk), or every
+                # record after it would be read shifted. Readers never consume a partial record.
+                size = os.fstat(fd).st_size
+                if size % self.record.itemsize:
+                    os.ftruncate(fd, size - size % self.record.itemsize)
+                view = memoryview(payload)
+                while view:
+                    written = os.write(fd, view)
+                    if written <= 0:
+                        raise OSError(f"Could not append to {wal_path}.")
+                    view = view[written:]
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self.refresh()
+        if checkpoint and self.checkpoint_every and self.delta_index.ntotal >= self.checkpoint_every:
+            self._start_checkpointer()
+
+    def _start_checkpointer(self):
+        """
+        Run `checkpoint()` in a child process (this module's command line),
+        so building the new snapshot takes neither memory nor CPU from the
+        serving process. At most one child per process; a child started
+        while another worker's is running exits at once.
+        """
+        with self._lock:
+            if self._checkpointer is not None and self._checkpointer.poll() is None:
+                return
+            self._checkpointer = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), os.path.abspath(self.directory), str(self.dimension),
+                 "--backend", self.backend, "--target-recall", str(self.target_recall),
+                 "--rerank-factor", str(self.rerank_factor)],
+                stdin=subprocess.DEVNULL,
+            )
+
+    def checkpoint(self, backend=None):
+        """
+        Fold the write-ahead log into a new snapshot and publish it atomically.
+
+        The snapshot index is built without holding the store lock, so
+        searches and appends continue against the old snapshot meanwhile;
+        records appended during the build are carried over into the new
+        snapshot's log. The merged vectors are copied chunk by chunk into
+        the new (memory-mapped) vectors file rather than into memory, and
+        the index is built from that file and streamed to disk. `backend`
+        overrides the configured backend, forcing a migration even when
+        there is nothing new to fold in.
+        Returns False if another worker is already checkpointing.
+        """
+        checkpoint_lock = self._file_lock(exclusive=True, name=CHECKPOINT_LOCK_FILE, blocking=False)
+        if checkpoint_lock is None:
+            return False
+        with checkpoint_lock:
+            with self._lock, self._file_lock(exclusive=False):
+                if self._read_manifest()["version"] != self.version:
+                    self._load()
+                else:
+                    self._replay_wal()
+                manifest = dict(self.manifest)
+                version, wal_offset = self.version, self.wal_offset
+                base_index, base_ids, base_vectors = self.base_index, self.base_ids, self.base_vectors
+                delta_ids = np.array(self.delta_ids, dtype="int64")
+                delta_vectors = self.delta_index.reconstruct_n(0, self.delta_index.ntotal) \
+                    if self.delta_index.ntotal else np.empty((0, self.dimension), dtype="float32")
+
+            ntotal = len(base_ids) + len(delta_ids)
+            target = choose_backend(ntotal, backend or self.backend)
+            current = manifest.get("backend", "flat")
+            if len(delta_ids) == 0 and (target == current or ntotal == 0):
+                return True
+
+            # Write the new snapshot under temporary names first; they are renamed into place only
+            # once the version is known not to have moved on meanwhile (e.g. by a reset).
+            old_files = self._snapshot_files(version)
+            new_version = version + 1
+            new_files = self._snapshot_files(new_version)
+            tmp_paths = [f"{path}.tmp.{os.getpid()}" for path in new_files[:3]]
+            try:
+                merged_ids = np.concatenate([np.asarray(base_ids), delta_ids])
+                self._write_synced(tmp_paths[1], lambda f: np.save(f, merged_ids))
+                merged_vectors = self._write_vectors(tmp_paths[2], base_vectors, delta_vectors)
+
+                if needs_rebuild(target, current, manifest.get("trained_ntotal", 0), ntotal):
+                    index = build_index(target, self.dimension, merged_vectors)
+                    for start in range(0, ntotal, CHECKPOINT_CHUNK_ROWS):
+                        index.add(np.ascontiguousarray(merged_vectors[start:start + CHECKPOINT_CHUNK_ROWS]))
+                    trained_ntotal = ntotal
+                else:
+                    # Same backend: read the snapshot into memory once and append the delta.
+                    index = faiss.read_index(old_files[0]) if version and os.path.exists(old_files[0]) \
+                        else faiss.clone_index(base_index)
+                    index.add(delta_vectors)
+                    trained_ntotal = manifest.get("trained_ntotal", ntotal)
+                search_params, _ = calibrate(index, target, merged_vectors, target_recall=self.target_recall,
+                                             rerank_factor=self.rerank_factor)
+                set_search_parameters(index, search_params)
+                self._write_synced(tmp_paths[0], lambda f: faiss.write_index(index, faiss.PyCallbackIOWriter(f.write)))
+                del index, merged_vectors
+
+                with self._lock, self._file_lock(exclusive=True):
+                    if self._read_manifest()["version"] != version:
+                        return False
+                    for tmp_path, path in zip(tmp_paths, new_files):
+                        os.replace(tmp_path, path)
+                    tail = b""
+                    if os.path.exists(old_files[3]):
+                        with open(old_files[3], "rb") as f:
+                            f.seek(wal_offset)
+                            tail = f.read()
+                        tail = tail[:len(tail) - len(tail) % self.record.itemsize]
+                    self._atomic_write(new_files[3], lambda f: f.write(tail))
+                    self._publish(new_version, {
+                        "ntotal": ntotal,
+                        "backend": target,
+                        "trained_ntotal": trained_ntotal,
+                        "search_params": search_params,
+                    }, old_files)
+                return True
+            finally:
+                for tmp_path in tmp_paths:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+
+    def _write_vectors(self, path, base_vectors, delta_vectors):
+        """
+        Write the snapshot's vectors followed by the delta's to a new .npy
+        file, a chunk at a time, and return it memory-mapped.
+        """
+        merged = np.lib.format.open_memmap(path, mode="w+", dtype="float32",
+                                           shape=(len(base_vectors) + len(delta_vectors), self.dimension))
+        for start in range(0, len(base_vectors), CHECKPOINT_CHUNK_ROWS):
+            end = min(start + CHECKPOINT_CHUNK_ROWS, len(base_vectors))
+            merged[start:end] = base_vectors[start:end]
+        merged[len(base_vectors):] = delta_vectors
+        merged.flush()
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return merged
+
+    def reset(self):
+        """
+        Publish a new, empty snapshot, discarding every stored vector.
+        """
+        with self._lock, self._file_lock(exclusive=True):
+            self.version = self._read_manifest()["version"]
+            self._publish(self.version + 1, {"ntotal": 0}, self._snapshot_files(self.version))
+
+    def _publish(self, new_version, manifest, old_files):
+        """
+        Point the manifest at `new_version`, drop the previous snapshot's
+        files and reload. Callers must hold the exclusive file lock.
+        """
+        manifest = dict(manifest, version=new_version)
+        self._atomic_write(self._path(MANIFEST_FILE), lambda f: f.write(json.dumps(manifest).encode()))
+        # Other workers keep their mmaps of the old files until they reload.
+        for path in old_files:
+            if os.path.exists(path):
+                os.remove(path)
+        self._load()
+
+    # --- Searching ---
+
+    def search(self, embeddings, k):
+        """
+        Search base and delta indexes for the `k` best matches per query.
+        Returns (similarities, patent_ids), both shaped (n, k); empty slots
+        have patent id -1. Call `refresh()` first to see other workers' writes.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype="float32").reshape(-1, self.dimension)
+        scores, ids = [], []
+        with self._rw.reading():
+            rerank = self.manifest.get("backend", "flat") in RERANK_BACKENDS
+            for index, id_map in ((self.base_index, self.base_ids),
+                                  (self.delta_index, np.array(self.delta_ids, dtype="int64"))):
+                if index.ntotal == 0:
+                    continue
+                if rerank and index is self.base_index:
+                    sims, positions = self._search_reranked(embeddings, k)
+                else:
+                    sims, positions = index.search(embeddings, min(k, index.ntotal))
+                scores.append(sims)
+                ids.append(np.where(positions >= 0, id_map[np.maximum(positions, 0)], -1))
+        if not scores:
+            n = embeddings.shape[0]
+            return np.full((n, 0), -np.inf, dtype="float32"), np.full((n, 0), -1, dtype="int64")
+
+        scores = np.hstack(scores)
+        ids = np.hstack(ids)
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        return (np.take_along_axis(scores, order, axis=1),
+                np.take_along_axis(ids, order, axis=1))
+
+    def _search_reranked(self, embeddings, k):
+        """
+        Search the compressed base index for `rerank_factor * k` candidates,
+        then score them exactly against the float32 vectors and keep the
+        best `k`. Returns (similarities, positions) like Index.search.
+        """
+        candidates = min(max(k * self.rerank_factor, k), self.base_index.ntotal)
+        _, positions = self.base_index.search(embeddings, candidates)
+        return rerank(embeddings, self.base_vectors, positions, k)
+
+
+if __name__ == "__main__":
+    # Started by IndexStore.add() to checkpoint outside the serving process; `flask index checkpoint`
+    # does the same by hand.
+    parser = argparse.ArgumentParser(description="Fold an index store's write-ahead log into a new snapshot.")
+    parser.add_argument("directory")
+    parser.add_argument("dimension", type=int)
+    parser.add_argument("--backend", default="auto")
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    args = parser.parse_args()
+    IndexStore(args.directory, args.dimension, backend=args.backend, target_recall=args.target_recall,
+               rerank_factor=args.rerank_factor).checkpoint()
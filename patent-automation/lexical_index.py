@@ -0,0 +1,188 @@
+# lexical_index.py
+import os
+import sqlite3
+import threading
+
+# Query terms beyond this many (e.g. when a whole description is the query) are ignored.
+MAX_QUERY_TERMS = 64
+
+# Query terms found in more than this fraction of patents are left out of the query: they barely
+# affect BM25 ranking, but scoring every patent that contains them makes a query cost a full scan.
+COMMON_TERM_FRACTION = 0.2
+# Document frequencies are cached per term while the index does not change (zero counts are not
+# cached, so a new patent's rare terms are found at once); the cache is also dropped at this many terms.
+MAX_CACHED_TERMS = 50_000
+
+# Constant of reciprocal-rank fusion: a document at rank r in a list scores 1 / (RRF_K + r).
+RRF_K = 60
+
+
+class LexicalIndex:
+    """
+    BM25 keyword index over patent titles and descriptions, in an SQLite
+    FTS5 table of its own file, so it works whatever DATABASE_URI points at
+    and is shared by every worker process.
+
+    The table is contentless (it keeps the inverted index, not a second
+    copy of the text) and its rowids are patent ids. English words are
+    stemmed, so "seal" also matches "seals". Patents are added as they are
+    submitted; `flask index backfill` adds any that are missing.
+    """
+
+    def __init__(self, path, title_weight=2.0, description_weight=1.0):
+        self.path = path
+        self.title_weight = title_weight
+        self.description_weight = description_weight
+        self._local = threading.local()
+        self._document_frequencies = {}
+        self._frequencies_max_id = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._create()
+
+    def _connection(self):
+        # One connection per thread, and new ones after fork(): sqlite3 connections must not be shared.
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _create(self):
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS patents_fts USING fts5("
+                "title, description, content='', tokenize='porter unicode61 remove_diacritics 2')"
+            )
+
+    def add(self, patent_ids, titles, descriptions):
+        """
+        Index patents. Ids already in the index are skipped.
+        """
+        rows = list(zip((int(patent_id) for patent_id in patent_ids), titles, descriptions))
+        if not rows:
+            return
+        with self._connection() as connection:
+            placeholders = ",".join("?" * len(rows))
+            existing = {row[0] for row in connection.execute(
+                f"SELECT rowid FROM patents_fts WHERE rowid IN ({placeholders})", [row[0] for row in rows]
+            )}
+            connection.executemany(
+                "INSERT INTO patents_fts(rowid, title, description) VALUES (?, ?, ?)",
+                [row for row in rows if row[0] not in existing],
+            )
+        self._document_frequencies = {}
+
+    def max_patent_id(self):
+        """
+        Highest patent id in the index, or 0 when it is empty.
+        """
+        return self._connection().execute("SELECT coalesce(max(rowid), 0) FROM patents_fts").fetchone()[0]
+
+    def count(self):
+        return self._connection().execute("SELECT count(*) FROM patents_fts").fetchone()[0]
+
+    def reset(self):
+        with self._connection() as connection:
+            connection.execute("DROP TABLE IF EXISTS patents_fts")
+        self._create()
+        self._document_frequencies = {}
+        self._frequencies_max_id = None
+
+    @staticmethod
+    def _phrase(term):
+        # Quoted as a phrase, so punctuation inside part numbers or chemical names
+        # (e.g. "XR-7/200") must match in sequence.
+        return '"' + term.replace('"', '""') + '"'
+
+    def _document_frequency(self, term):
+        frequencies = self._document_frequencies
+        frequency = frequencies.get(term)
+        if frequency is None:
+            frequency = self._connection().execute(
+                "SELECT count(*) FROM patents_fts WHERE patents_fts MATCH ?", [self._phrase(term)]
+            ).fetchone()[0]
+            if frequency:
+                if len(frequencies) >= MAX_CACHED_TERMS:
+                    frequencies.clear()
+                frequencies[term] = frequency
+        return frequency
+
+    def build_query(self, text):
+        """
+        Turn free text into an FTS5 query matching any of its terms, leaving
+        out terms so common that they would only slow the query down.
+        """
+        terms = []
+        for term in text.split():
+            term = term.strip(".,;:!?()[]{}'\"").casefold()
+            if term and term not in terms:
+                terms.append(term)
+            if len(terms) == MAX_QUERY_TERMS:
+                break
+        if not terms:
+            return ""
+        max_id = self.max_patent_id()
+        if max_id != self._frequencies_max_id:
+            # Patents were added, here or by another worker: cached counts are stale.
+            self._document_frequencies = {}
+            self._frequencies_max_id = max_id
+        frequencies = [self._document_frequency(term) for term in terms]
+        limit = max(1, COMMON_TERM_FRACTION * max_id)
+        selective = [term for term, frequency in zip(terms, frequencies) if 0 < frequency <= limit]
+        if not selective:
+            # Only common words: rank by the least common one.
+            present = [(frequency, term) for term, frequency in zip(terms, frequencies) if frequency]
+            selective = [min(present)[1]] if present else []
+        return " OR ".join(self._phrase(term) for term in selective)
+
+    def search(self, text, limit):
+        """
+        Rank patents matching any term of `text` by BM25. Returns a list of
+        (patent_id, score) pairs, best first; higher scores are better.
+        """
+        query = self.build_query(text)
+        if not query or limit <= 0:
+            return []
+        rows = self._execute(
+            f"SELECT rowid, bm25(patents_fts, {self.title_weight:f}, {self.description_weight:f}) AS score "
+            "FROM patents_fts WHERE patents_fts MATCH ? ORDER BY score LIMIT ?",
+            [query, limit],
+        )
+        # FTS5's bm25() is negative, lower meaning more relevant.
+        return [(patent_id, -score) for patent_id, score in rows]
+
+    def matching(self, text, patent_ids):
+        """
+        The subset of `patent_ids` containing any term of `text`.
+        """
+        query = self.build_query(text)
+        if not query:
+            return set()
+        # Cheaper than constraining the MATCH by rowid: FTS5 would still evaluate the whole match.
+        rows = self._execute("SELECT rowid FROM patents_fts WHERE patents_fts MATCH ?", [query])
+        matches = {row[0] for row in rows}
+        return {int(patent_id) for patent_id in patent_ids} & matches
+
+    def _execute(self, sql, params):
+        try:
+            return self._connection().execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            print(f"Warning: lexical search failed: {e}")
+            return []
+
+
+def reciprocal_rank_fusion(*rankings, k=RRF_K):
+    """
+    Fuse ranked lists of patent ids: each id scores the sum of
+    1 / (k + rank) over the lists it appears in (ranks start at 1).
+    Returns [(patent_id, score)] sorted best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, patent_id in enumerate(ranking, start=1):
+            scores[patent_id] = scores.get(patent_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
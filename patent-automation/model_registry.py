@@ -0,0 +1,64 @@
+# model_registry.py
+import threading
+import time
+
+
+class ModelRegistry:
+    """
+    Named heavy dependencies (models, indexes, API clients) that are built
+    on first use instead of at import time.
+
+    `register(name, factory)` records how to build an object; `get(name)`
+    builds it once, thread-safely, and returns the same instance afterwards.
+    `warm_up()` builds everything up front, e.g. in a gunicorn master before
+    it forks workers so they share the loaded pages copy-on-write.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._load_seconds = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory):
+        with self._lock:
+            self._factories[name] = factory
+            self._locks[name] = threading.Lock()
+
+    def loaded(self, name):
+        return name in self._instances
+
+    def get(self, name):
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        if name not in self._factories:
+            raise KeyError(f"No model registered as {name!r}.")
+        # One lock per name, so a slow load does not hold up the others.
+        with self._locks[name]:
+            if name not in self._instances:
+                started = time.perf_counter()
+                self._instances[name] = self._factories[name]()
+                self._load_seconds[name] = time.perf_counter() - started
+            return self._instances[name]
+
+    def warm_up(self, names=None):
+        """
+        Load `names` (default: everything registered) and return the seconds
+        each load took; already loaded objects are not rebuilt.
+        """
+        names = list(names or self._factories)
+        for name in names:
+            self.get(name)
+        return {name: self._load_seconds.get(name) for name in names}
+
+    def stats(self):
+        return {
+            name: {"loaded": self.loaded(name), "load_seconds": self._load_seconds.get(name)}
+            for name in self._factories
+        }
+
+
+# Shared by the Flask app, its CLI commands and gunicorn.conf.py.
+registry = ModelRegistry()
@@ -7,3 +7,25 @@ class Patent(db.Model):
     id = db.Column(db.Integer, primary_key=True, unique=True)
     title = db.Column(db.String(255), nullable=False, unique=True)
     description = db.Column(db.Text, nullable=False)  # Increased length to accommodate large descriptions
+
+class GeneratedDocument(db.Model):
+    __tablename__ = 'generated_documents'
+
+    # sha256 over title, description, prompt version, model and temperature (see document_cache.py)
+    key = db.Column(db.String(64), primary_key=True)
+    title = db.Column(db.String(255), nullable=False)
+    model = db.Column(db.String(64), nullable=False)
+    prompt_version = db.Column(db.String(32), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    size_bytes = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    last_accessed_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class IndexOutbox(db.Model):
+    __tablename__ = 'index_outbox'
+
+    # One row per patent committed but not yet added to the FAISS and keyword indexes
+    # (see index_outbox.py); inserted in the same transaction as the patent.
+    id = db.Column(db.Integer, primary_key=True)
+    patent_id = db.Column(db.Integer, db.ForeignKey('patents.id'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
@@ -1,13 +1,32 @@
 # operations.py
 import os
-import faiss
+import json
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import openai
 from dotenv import load_dotenv
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context, url_for
 from extensions import db
-from models import Patent
+from models import IndexOutbox, Patent
+from model_registry import registry
+from embedding_backends import load_embedder
+from embedding_batcher import EmbeddingBatcher
+from caches import GenerationCache, LRUCache, text_key
+from chunking import chunk_documents, max_sim_per_patent, split_into_windows
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from search_results import SearchRequestError, hydrate, load_patent_fields, paginate, parse_search_options
+from generation_jobs import GenerationJobManager, JobLimitError
+from index_outbox import IndexOutboxApplier
+from stage_timing import StageTimer
+from document_cache import DocumentCache
+from patent_sections import (
+    PATENT_SECTIONS,
+    build_patent_prompt,
+    build_section_prompt,
+    find_section,
+    generate_sections,
+    stitch_sections,
+)
+from datetime import datetime, timedelta
 
 # Create a Flask Blueprint for our operations.
 operations = Blueprint('operations', __name__)
@@ -15,146 +34,470 @@ operations = Blueprint('operations', __name__)
 # Load environment variables
 load_dotenv()
 
-# Set up OpenAI API key with a check.
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise ValueError("Error: OPENAI_API_KEY not found. Please check your .env file.")
-openai.api_key = OPENAI_API_KEY
+# Per-stage timings of the hot paths, sent as Server-Timing headers and exported at /metrics.
+stage_timer = StageTimer()
+stage = stage_timer.stage
 
-# Initialize the SentenceTransformer model.
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# Heavy dependencies (the embedding model, the FAISS index and the openai package) are
+# registered here and only loaded on first use, or up front by warm_up(), so importing this
+# module (flask db upgrade, CLI commands, gunicorn's master) stays fast.
 
-# FAISS setup: using IndexFlatIP (with normalized embeddings, inner product equals cosine similarity)
+def load_openai():
+    # Checked on first use rather than at import, so tasks that never call OpenAI work without a key.
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("Error: OPENAI_API_KEY not found. Please check your .env file.")
+    import openai
+    openai.api_key = api_key
+    # OPENAI_API_BASE (read by the openai package) can point at fake_openai.py for local testing.
+    return openai
+
+registry.register("openai", load_openai)
+
+def get_openai():
+    return registry.get("openai")
+
+GENERATION_MODEL = "gpt-4"
+GENERATION_TEMPERATURE = 0.3
+# "single" asks for the whole document in one completion; "sectioned" generates the seven
+# sections concurrently (see patent_sections.py). Requests can override it with "mode".
+GENERATION_MODE = os.getenv("GENERATION_MODE", "single")
+# Retries of a rate-limited completion: of the whole job in single mode, of each section in sectioned mode.
+GENERATION_MAX_RETRIES = int(os.getenv("GENERATION_MAX_RETRIES", "4"))
+# Section completions of every sectioned job share this pool, so GENERATION_SECTION_WORKERS bounds the
+# completions in flight per worker however many jobs are running.
+section_executor = ThreadPoolExecutor(max_workers=int(os.getenv("GENERATION_SECTION_WORKERS", "8")),
+                                      thread_name_prefix="section")
+# Bump whenever the prompts in patent_sections.py change so documents cached from the old prompts are not reused.
+PATENT_PROMPT_VERSION = "1"
+
+# Generated documents are cached in the database, keyed on everything that determines the output.
+document_cache = DocumentCache(
+    ttl=timedelta(days=float(os.getenv("GENERATION_CACHE_TTL_DAYS", "30"))),
+    max_entries=int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "10000")),
+)
+
+# The SentenceTransformer model. EMBEDDING_BACKEND picks how it runs: torch (the reference),
+# torch-int8, onnx or onnx-int8 (see embedding_backends.py); EMBEDDING_THREADS caps its CPU threads.
+# Vectors from different backends differ slightly, so rebuild the index after switching
+# (flask index backfill --rebuild) and check the drift first with `flask embeddings parity`.
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0")) or None
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "onnx_model")
+
+def load_embedding_model(backend=None):
+    return load_embedder(backend or EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME, EMBEDDING_ONNX_DIR,
+                         threads=EMBEDDING_THREADS)
+
+registry.register("embedding_model", load_embedding_model)
+
+# FAISS setup: using IndexFlatIP (with normalized embeddings, inner product equals cosine similarity).
+# The index and its patent id map are persisted under FAISS_INDEX_DIR and memory-mapped when first used.
 dimension = 384
-faiss_index = faiss.IndexFlatIP(dimension)
-faiss_patent_ids = []  # Global list to map FAISS index positions to patent IDs.
+
+def load_index_store():
+    from index_store import IndexStore
+    # FAISS_INDEX_BACKEND is one of auto, flat, hnsw, ivfpq, sq8 or fp16; "auto" moves to approximate search
+    # as the corpus grows. sq8/fp16 keep 4x/2x smaller vectors in memory; FAISS_RERANK_FACTOR sets how many
+    # candidates per result they (and ivfpq) re-score exactly from the float32 vectors on disk.
+    # Every FAISS_CHECKPOINT_EVERY appended vectors a child process folds them into a new snapshot;
+    # 0 turns that off, e.g. to run `flask index checkpoint` from cron instead.
+    return IndexStore(
+        os.getenv("FAISS_INDEX_DIR", "faiss_index"),
+        dimension,
+        checkpoint_every=int(os.getenv("FAISS_CHECKPOINT_EVERY", "10000")),
+        backend=os.getenv("FAISS_INDEX_BACKEND", "auto"),
+        target_recall=float(os.getenv("FAISS_TARGET_RECALL", "0.95")),
+        rerank_factor=int(os.getenv("FAISS_RERANK_FACTOR", "4")),
+    )
+
+registry.register("index_store", load_index_store)
+
+def get_index_store():
+    return registry.get("index_store")
+
+# BM25 keyword index of titles and descriptions (SQLite FTS5), kept next to the FAISS index by default.
+def load_lexical_index():
+    default_path = os.path.join(os.getenv("FAISS_INDEX_DIR", "faiss_index"), "lexical.db")
+    return LexicalIndex(os.getenv("LEXICAL_INDEX_PATH", default_path))
+
+registry.register("lexical_index", load_lexical_index)
+
+def get_lexical_index():
+    return registry.get("lexical_index")
+
+def warm_up():
+    """
+    Load the models now instead of on first request (the openai package only
+    if an API key is configured). Returns the seconds each load took.
+    """
+    names = ["embedding_model", "index_store", "lexical_index"]
+    if os.getenv("OPENAI_API_KEY"):
+        names.append("openai")
+    return registry.warm_up(names)
+
+def get_text_embeddings(texts, batch_size=256):
+    """
+    Batch version of get_text_embedding for bulk indexing.
+    Returns a normalized numpy array of shape (len(texts), dimension) with dtype float32.
+    """
+    with stage("embed"):
+        return encode_texts(texts, batch_size=batch_size)
+
+def encode_texts(texts, batch_size=256):
+    # get_text_embeddings without the timing, for the batcher: its callers time their own wait.
+    embeddings = registry.get("embedding_model").encode(list(texts), batch_size=batch_size)
+    embeddings = np.asarray(embeddings, dtype='float32').reshape(-1, dimension)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    np.divide(embeddings, norms, out=embeddings, where=norms > 0)
+    return embeddings
+
+# Concurrent requests' single-text encodes are coalesced into one batched forward pass.
+# EMBED_MAX_BATCH_SIZE=1 disables batching.
+embedding_batcher = EmbeddingBatcher(
+    encode_texts,
+    max_batch_size=int(os.getenv("EMBED_MAX_BATCH_SIZE", "32")),
+    max_wait_ms=float(os.getenv("EMBED_MAX_WAIT_MS", "5")),
+)
+
+# Caches keyed by a hash of the normalized text. Search results are dropped whenever
+# the index generation changes, i.e. on every index append in this or another worker.
+# Spilled embeddings are kept per model and backend: vectors of another backend differ slightly.
+# EMBED_CACHE_SPILL_MB bounds the spill directory (per worker process).
+EMBED_CACHE_SPILL_DIR = os.getenv("EMBED_CACHE_SPILL_DIR")
+embedding_cache = LRUCache(
+    int(float(os.getenv("EMBED_CACHE_MB", "64")) * 1024 * 1024),
+    spill_dir=os.path.join(EMBED_CACHE_SPILL_DIR, f"{EMBEDDING_MODEL_NAME}-{EMBEDDING_BACKEND}".replace("/", "_"))
+    if EMBED_CACHE_SPILL_DIR else None,
+    spill_max_bytes=int(float(os.getenv("EMBED_CACHE_SPILL_MB", "256")) * 1024 * 1024),
+)
+search_cache = GenerationCache(int(float(os.getenv("SEARCH_CACHE_MB", "8")) * 1024 * 1024))
+
+# Chunked indexing: the model only reads the first 256 word pieces (~180 words) of a text, so with
+# INDEX_CHUNK_WORDS set, longer descriptions and queries are embedded as overlapping windows of that
+# many words, each indexed under its patent id, and a patent scores as its best-matching window.
+# 0 disables chunking; rebuild the index after changing either setting (flask index backfill --rebuild).
+INDEX_CHUNK_WORDS = int(os.getenv("INDEX_CHUNK_WORDS", "0"))
+INDEX_CHUNK_OVERLAP = int(os.getenv("INDEX_CHUNK_OVERLAP", "32"))
+if INDEX_CHUNK_WORDS > 0 and not 0 <= INDEX_CHUNK_OVERLAP < INDEX_CHUNK_WORDS:
+    # An overlap as long as the window would advance one word per window, multiplying the vectors stored.
+    raise ValueError(f"Error: INDEX_CHUNK_OVERLAP ({INDEX_CHUNK_OVERLAP}) must be at least 0 and less than "
+                     f"INDEX_CHUNK_WORDS ({INDEX_CHUNK_WORDS}).")
+# A patent can fill several hits with its windows, so chunked searches fetch this many times k hits.
+CHUNK_SEARCH_OVERSAMPLE = 4
 
 def get_text_embedding(text):
     """
-    Convert text to a vector embedding using SentenceTransformer.
+    Convert text to a vector embedding with the configured embedding backend.
     Returns a normalized numpy array of shape (dimension,) with dtype float32.
     """
-    embedding = model.encode(text)
+    key = text_key(text)
+    embedding = embedding_cache.get(key)
+    if embedding is not None:
+        return embedding
+    with stage("embed"):
+        if embedding_batcher.max_batch_size <= 1:
+            embedding = encode_texts([text])[0]
+        else:
+            embedding = embedding_batcher.submit(text).result()
+    # Copy out of the batch array so the cache holds (and accounts for) just this row;
+    # read-only because cached arrays are shared between callers.
     embedding = np.array(embedding, dtype='float32')
-    norm = np.linalg.norm(embedding)
-    if norm > 0:
-        embedding = embedding / norm
+    embedding.setflags(write=False)
+    embedding_cache.put(key, embedding)
     return embedding
 
-def store_embedding(patent_id, text):
+def get_chunk_embeddings(text):
+    """
+    Embed each window of `text` (just the text itself when it is short or
+    chunking is off). Returns an array of shape (windows, dimension).
+    """
+    chunks = split_into_windows(text, INDEX_CHUNK_WORDS, INDEX_CHUNK_OVERLAP)
+    if len(chunks) == 1:
+        return get_text_embedding(text).reshape(1, -1)  # Ensure it's 2D for FAISS.
+    return get_text_embeddings(chunks)
+
+def get_document_embeddings(patent_ids, texts, batch_size=256):
+    """
+    Batch version of get_chunk_embeddings for bulk indexing: every window of
+    every text is embedded in one batched encode. Returns (chunk_patent_ids,
+    embeddings) ready for IndexStore.add.
+    """
+    chunk_patent_ids, chunks = chunk_documents(patent_ids, texts, INDEX_CHUNK_WORDS, INDEX_CHUNK_OVERLAP)
+    return chunk_patent_ids, get_text_embeddings(chunks, batch_size=batch_size)
+
+def index_patents(patent_ids, titles, descriptions, batch_size=256, checkpoint=True):
+    """
+    Add committed patents to the FAISS index store (one normalized embedding
+    per description window, embedded in one batch) and the keyword index.
+    Bulk loads pass checkpoint=False and checkpoint once at the end.
+    """
+    chunk_patent_ids, embeddings = get_document_embeddings(patent_ids, descriptions, batch_size=batch_size)
+    with stage("index_append"):
+        get_index_store().add(chunk_patent_ids, embeddings, checkpoint=checkpoint)
+        get_lexical_index().add(patent_ids, titles, descriptions)
+
+def sync_index():
+    # Replay other workers' appends even while this worker serves no searches.
+    if registry.loaded("index_store"):
+        get_index_store().refresh()
+
+# /submit queues index writes in an outbox table, in the same transaction as the patent row.
+index_outbox = IndexOutboxApplier(
+    index_patents,
+    sync_index,
+    os.path.join(os.getenv("FAISS_INDEX_DIR", "faiss_index"), "outbox.lock"),
+    interval=float(os.getenv("INDEX_SYNC_INTERVAL", "2")),
+)
+
+def rank_similar_patents(input_text, n):
     """
-    Generate a normalized embedding for the given text and store it in FAISS.
-    Also update the global mapping from FAISS index position to the patent_id.
+    Rank the n patents most similar to `input_text` by embedding similarity.
+    Returns a list of tuples: (patent_id, similarity score), best first.
+    Results are cached until the index changes.
     """
-    embedding = get_text_embedding(text)
-    embedding = embedding.reshape(1, -1)  # Ensure it's 2D for FAISS.
-    faiss_index.add(embedding)
-    faiss_patent_ids.append(patent_id)
+    return rank_similar_patents_batch([input_text], n)[0]
+
+def rank_similar_patents_batch(input_texts, n, batch_size=256):
+    """
+    Batch version of rank_similar_patents for screening many queries: every
+    query (and query window) not already cached is embedded in one batched
+    encode and searched in a single multi-row FAISS search.
+    Returns one ranked list per input text, in input order.
+    """
+    index_store = get_index_store()
+    index_store.refresh()  # Pick up patents submitted through other workers.
+    if index_store.ntotal == 0:
+        print("Warning: FAISS index is empty. No patents have been stored yet.")
+        return [[] for _ in input_texts]
+
+    generation = index_store.generation
+    keys = [text_key(text) for text in input_texts]
+    ranked = {}
+    missing = {}
+    for key, text in zip(keys, input_texts):
+        results = search_cache.get((key, n), generation)
+        if results is not None:
+            ranked[key] = list(results)
+        else:
+            missing.setdefault(key, text)
+
+    if missing:
+        if len(missing) == 1:
+            # A single query (e.g. /search) goes through the embedding cache and the cross-request batcher.
+            embeddings = get_chunk_embeddings(next(iter(missing.values())))
+            owners = np.zeros(len(embeddings), dtype="int64")
+        else:
+            owners, chunks = chunk_documents(range(len(missing)), missing.values(),
+                                             INDEX_CHUNK_WORDS, INDEX_CHUNK_OVERLAP)
+            embeddings = get_text_embeddings(chunks, batch_size=batch_size)
+        hits = n * CHUNK_SEARCH_OVERSAMPLE if INDEX_CHUNK_WORDS > 0 else n
+        with stage("index_search"):
+            similarities, patent_ids = index_store.search(embeddings, hits)
+        # Windows of the same query are adjacent rows; split at the boundaries between queries.
+        # Each patent then scores as its best match over every (query window, indexed window) pair.
+        boundaries = np.flatnonzero(np.diff(owners)) + 1
+        for key, sims, ids, rows in zip(missing, np.split(similarities, boundaries), np.split(patent_ids, boundaries),
+                                        np.split(embeddings, boundaries)):
+            best_ids, best_sims = max_sim_per_patent(sims, ids)
+            # Several hits of one patent (its windows, or vectors appended twice after a crash) can leave
+            # fewer than n distinct patents while more exist: search that query again, wider.
+            wider = hits
+            while len(best_ids) < n and (ids >= 0).all() and wider < index_store.ntotal:
+                wider *= 2
+                with stage("index_search"):
+                    sims, ids = index_store.search(rows, wider)
+                best_ids, best_sims = max_sim_per_patent(sims, ids)
+            results = [(int(patent_id), float(sim)) for patent_id, sim in zip(best_ids[:n], best_sims[:n])]
+            search_cache.put((key, n), tuple(results), generation)
+            ranked[key] = results
+    return [ranked[key] for key in keys]
 
 def find_similar_patents(input_text, k=5, threshold=0.8):
     """
     Find k similar patents given an input text.
-    Returns a list of tuples: (patent_id, similarity score)
+    Returns a list of tuples: (patent_id, similarity score), best first,
     where similarity score is greater than or equal to the threshold.
     """
-    if faiss_index.ntotal == 0:
-        print("Warning: FAISS index is empty. No patents have been stored yet.")
-        return []
-    
-    input_embedding = get_text_embedding(input_text).reshape(1, -1)
-    similarities, indices = faiss_index.search(input_embedding, k)
-    
-    results = [
-        (faiss_patent_ids[idx], sim)
-        for idx, sim in zip(indices[0], similarities[0])
-        if idx < len(faiss_patent_ids) and sim >= threshold
-    ]
-    return results
-
-def generate_patent_section(title, description):
+    return [(patent_id, sim) for patent_id, sim in rank_similar_patents(input_text, k) if sim >= threshold]
+
+# /search modes: "dense" ranks by embedding similarity alone; "hybrid" fuses it with BM25 keyword
+# ranking (reciprocal-rank fusion), so exact part numbers and chemical names surface; "prefilter" keeps
+# only the embedding candidates that also contain a query keyword.
+SEARCH_MODES = ("dense", "hybrid", "prefilter")
+# Candidates taken from each retriever before fusing or filtering.
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "100"))
+
+def search_patents(query, k=5, mode="dense"):
     """
-    Generate a long-form, highly technical, and legally robust patent document
-    for an invention using OpenAI's GPT-4.
-    """
-    prompt = f"""You are an expert patent writer with deep knowledge of engineering, AI, physics, chemistry, and law.
-Write a comprehensive, legally robust, and highly technical patent document for the given invention.
-
----
-📌 Patent Structure & Guidelines:
-
-1. Abstract (500+ words)
-   - Provide a clear, scientific, and technical summary of the invention.
-   - Use formal engineering language, precise terminology, and industry-standard concepts.
-   - Highlight performance improvements, novel aspects, and how the invention surpasses prior art.
-
-2. Background & Problem Statement (600+ words)
-   - Explain the industry challenges, scientific limitations, and technological gaps that necessitate this invention.
-   - Reference existing patents, academic papers, or industry standards.
-   - Discuss the inefficiencies or flaws in current solutions.
-
-3. Summary of the Invention (700+ words)
-   - Describe how the invention solves the identified problem.
-   - Include technical comparisons, performance benchmarks, and novel technical mechanisms.
-   - Provide quantitative improvements over existing technology.
-
-4. Claims (Legal Section) (800+ words)
-   - Structure broad independent claims followed by detailed dependent claims.
-   - Ensure claim wording is legally defensible and specific to prevent infringement loopholes.
-   - Use precise, numbered, structured formatting (e.g., "1. A system comprising...").
-   - Cover all possible variations of the invention to maximize patent coverage.
-
-5. Detailed Description (1500+ words)
-   - Technical Breakdown: Explain the system architecture, key components, and operational flow.
-   - Material Science & Composition: Describe chemical, molecular, or nanomaterial structures if applicable.
-   - Electrical & Mechanical Design: Provide circuit diagrams, flowcharts, stress analysis, and component details.
-   - Software & AI/ML Algorithms: Discuss the training dataset, model architecture, optimization methods, and algorithmic flow.
-   - Thermal & Structural Analysis: Explain how the design handles heat dissipation, mechanical stress, and energy transfer.
-   - Manufacturing & Scalability: Describe production methods, feasibility of large-scale deployment, and potential modifications.
-
-6. Figures & Illustrations (Placeholder Texts)
-   - Insert placeholders such as [Figure 1: System Architecture Diagram] and [Table 1: Performance Comparison].
-   - Describe what each diagram should illustrate.
-
-7. Industrial Applications & Market Feasibility (500+ words)
-   - Discuss real-world use cases, market adoption, regulatory hurdles, and future scalability.
-   - Mention government compliance, patent licensing opportunities, and the competitive landscape.
-
----
-📌 Formatting Rules:
-- Use highly technical, legally precise, and engineering-driven language.
-- Include scientific formulas, performance metrics, and comparative data.
-- Use formal structured headings and numbered subsections.
-- Ensure the output is at least 5000 words in total.
-
-📌 Patent Title: {title}
-📌 Patent Description: {description}
-"""
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are an expert patent lawyer and technical writer."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=4096,
-            n=1
-        )
-        return response["choices"][0]["message"]["content"]
-    except openai.error.RateLimitError:
+    Rank patents for `query` in one of SEARCH_MODES.
+    Returns a list of tuples: (patent_id, similarity, score), best first.
+    `similarity` is the embedding similarity (None for patents only found
+    by keyword); `score` is what the list is ordered by: the similarity,
+    or the fused rank score in hybrid mode.
+    """
+    if mode == "dense":
+        return [(patent_id, sim, sim) for patent_id, sim in rank_similar_patents(query, k)]
+
+    candidates = max(k, HYBRID_CANDIDATES)
+    dense = rank_similar_patents(query, candidates)
+    if mode == "prefilter":
+        with stage("keyword_search"):
+            matching = get_lexical_index().matching(query, [patent_id for patent_id, _ in dense])
+        return [(patent_id, sim, sim) for patent_id, sim in dense if patent_id in matching][:k]
+
+    with stage("keyword_search"):
+        lexical = get_lexical_index().search(query, candidates)
+    similarities = dict(dense)
+    fused = reciprocal_rank_fusion([patent_id for patent_id, _ in dense], [patent_id for patent_id, _ in lexical])
+    return [(patent_id, similarities.get(patent_id), score) for patent_id, score in fused[:k]]
+
+def describe_openai_error(error):
+    """
+    Turn an exception from an OpenAI call into the message shown to the user.
+    """
+    if not registry.loaded("openai"):
+        # Nothing has called OpenAI yet (e.g. the API key is missing), so this is not an OpenAI error.
+        return f"Unexpected Error: {error}"
+    openai = get_openai()
+    if isinstance(error, openai.error.RateLimitError):
         return "Error: OpenAI rate limit exceeded. Check your usage and billing settings."
-    except openai.error.AuthenticationError:
+    if isinstance(error, openai.error.AuthenticationError):
         return "Error: Invalid OpenAI API key. Please verify your credentials."
+    return f"Unexpected Error: {error}"
+
+def complete_chat_prompt(prompt, on_token=None):
+    """
+    Send a patent-writing prompt to GPT-4 and return the reply, raising OpenAI errors.
+    If on_token is given the completion is streamed and each chunk of text is
+    passed to it as it arrives.
+    """
+    request_args = dict(
+        model=GENERATION_MODEL,
+        messages=[
+            {"role": "system", "content": "You are an expert patent lawyer and technical writer."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=GENERATION_TEMPERATURE,
+        max_tokens=4096,
+        n=1
+    )
+    openai = get_openai()
+    with stage("llm"):
+        if on_token is None:
+            response = openai.ChatCompletion.create(**request_args)
+            return response["choices"][0]["message"]["content"]
+
+        parts = []
+        for chunk in openai.ChatCompletion.create(stream=True, **request_args):
+            text = chunk["choices"][0].get("delta", {}).get("content")
+            if text:
+                parts.append(text)
+                on_token(text)
+        return "".join(parts)
+
+def complete_patent_document(title, description, on_token=None):
+    """
+    Ask GPT-4 for the whole patent document in a single completion.
+    """
+    return complete_chat_prompt(build_patent_prompt(title, description), on_token=on_token)
+
+def document_cache_key(title, description):
+    return DocumentCache.key_for(title, description, PATENT_PROMPT_VERSION, GENERATION_MODEL, GENERATION_TEMPERATURE)
+
+def cache_patent_document(cache_key, title, content):
+    with stage("db"):
+        document_cache.put(cache_key, content, title=title, model=GENERATION_MODEL,
+                           prompt_version=PATENT_PROMPT_VERSION)
+
+def generate_patent_section(title, description, force_regenerate=False):
+    """
+    Generate a long-form, highly technical, and legally robust patent document
+    for an invention using OpenAI's GPT-4. Previously generated documents are
+    served from the document cache unless force_regenerate is set.
+    """
+    cache_key = document_cache_key(title, description)
+    if not force_regenerate:
+        cached = document_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    try:
+        content = complete_patent_document(title, description)
     except Exception as e:
-        return f"Unexpected Error: {e}"
+        return describe_openai_error(e)
+    cache_patent_document(cache_key, title, content)
+    return content
+
+def section_cache_key(title, description, index):
+    prompt_version = f"{PATENT_PROMPT_VERSION}/section/{PATENT_SECTIONS[index][0]}"
+    return DocumentCache.key_for(title, description, prompt_version, GENERATION_MODEL, GENERATION_TEMPERATURE)
+
+def generate_sectioned_document(title, description, on_token=None, regenerate=None):
+    """
+    Generate the seven patent sections concurrently, each in its own completion
+    with its own max_tokens budget, and stitch them together in order.
+    Sections are cached individually: `regenerate` is a collection of section
+    indexes to generate afresh (None regenerates nothing, so only missing
+    sections are generated). Raises OpenAI errors; needs an app context.
+    """
+    regenerate = set(regenerate or ())
+    keys = [section_cache_key(title, description, i) for i in range(len(PATENT_SECTIONS))]
+    texts = [None if i in regenerate else document_cache.get(key) for i, key in enumerate(keys)]
+    missing = [i for i, text in enumerate(texts) if text is None]
+    try:
+        generate_sections(
+            texts,
+            lambda index, emit: complete_chat_prompt(
+                build_section_prompt(title, description, index), on_token=emit if on_token else None
+            ),
+            on_token=on_token,
+            retry_on=(get_openai().error.RateLimitError,),
+            max_retries=GENERATION_MAX_RETRIES,
+            executor=section_executor,
+        )
+    finally:
+        # Keep whatever finished, even if another section failed.
+        for i in missing:
+            if texts[i] is not None:
+                document_cache.put(keys[i], texts[i], title=title, model=GENERATION_MODEL,
+                                   prompt_version=f"{PATENT_PROMPT_VERSION}/section")
+    return stitch_sections(texts)
+
+def rate_limit_errors():
+    return (get_openai().error.RateLimitError,) if registry.loaded("openai") else ()
+
+# /generate runs as a background job on a bounded thread pool; clients poll or stream the result.
+generation_jobs = GenerationJobManager(
+    max_workers=int(os.getenv("GENERATION_WORKERS", "4")),
+    max_pending=int(os.getenv("GENERATION_MAX_PENDING", "64")),
+    max_jobs_per_key=int(os.getenv("GENERATION_JOBS_PER_CLIENT", "2")),
+    retry_on=rate_limit_errors,
+    max_retries=GENERATION_MAX_RETRIES,
+    describe_error=describe_openai_error,
+    # Shared by the workers, so any of them can answer a job's status and stream URLs.
+    store_dir=os.getenv("GENERATION_JOBS_DIR", "generation_jobs"),
+)
 
 # --- Flask Endpoints ---
 
+@operations.before_app_request
+def start_index_outbox():
+    index_outbox.ensure_running(current_app._get_current_object())
+
+@operations.before_request
+def start_stage_timing():
+    stage_timer.start_request()
+
+@operations.after_request
+def add_server_timing(response):
+    return stage_timer.finish_request(response)
+
 @operations.route("/submit", methods=["POST"])
 def submit_patent_route():
     """
-    Accepts a patent submission (title and description), stores the embedding,
-    and saves it to the database.
+    Accepts a patent submission (title and description), saves it to the
+    database and adds it to the search indexes before responding.
     """
     data = request.get_json()
     if not data:
@@ -165,14 +508,21 @@ def submit_patent_route():
     if not title or not description:
         return jsonify({"error": "Title and description are required."}), 400
 
-    # Store in Database
-    new_patent = Patent(title=title, description=description)
-    db.session.add(new_patent)
-    db.session.commit()
+    # Store in Database, queuing the index write in the same transaction
+    with stage("db"):
+        new_patent = Patent(title=title, description=description)
+        db.session.add(new_patent)
+        db.session.flush()
+        patent_id = new_patent.id  # Get the new patent's ID from the DB
+        db.session.add(IndexOutbox(patent_id=patent_id, created_at=datetime.utcnow()))
+        db.session.commit()
 
-    # Store in FAISS index
-    patent_id = new_patent.id  # Get the new patent's ID from the DB
-    store_embedding(patent_id, description)
+    # Store in FAISS and keyword indexes
+    try:
+        index_outbox.drain()
+    except Exception as e:
+        # The patent is committed; the background applier retries indexing it.
+        print(f"Warning: indexing patent {patent_id} failed and will be retried: {e}")
 
     return jsonify({"message": "Patent submitted successfully.", "patent_id": patent_id}), 200
 
@@ -180,7 +530,17 @@ def submit_patent_route():
 def search_patents_route():
     """
     Searches for similar patents based on the provided query.
-    Returns a JSON object with a boolean "isNovel" key.
+    Returns a JSON object with a boolean "isNovel" key, one page of ranked
+    "results" (patent id, similarity, score and the requested "fields")
+    and a "next_cursor" to pass back as "cursor" for the next page.
+
+    "mode" is one of "dense" (default), "hybrid" or "prefilter"; "k" is the
+    page size and "threshold" the similarity a patent needs to count
+    against novelty. In every mode novelty is judged on the embedding
+    ranking alone; keyword fusion and filtering only decide which results
+    are listed, and in what order. In dense and prefilter mode only
+    patents above the threshold are returned; hybrid results also include
+    keyword matches below it.
     """
     data = request.get_json()
     if not data:
@@ -190,14 +550,124 @@ def search_patents_route():
     if not query:
         return jsonify({"error": "Query is required."}), 400
 
-    results = find_similar_patents(query, k=5, threshold=0.8)
-    is_novel = len(results) == 0  # Returns True if no similar patents exist
-    return jsonify({"isNovel": is_novel}), 200
+    mode = data.get("mode", "dense")
+    if mode not in SEARCH_MODES:
+        return jsonify({"error": f"Mode must be one of: {', '.join(SEARCH_MODES)}."}), 400
+    try:
+        k, threshold, fields, cursor = parse_search_options(data)
+    except SearchRequestError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Rank from the top on every page; the extra k leaves room for patents added since the last page.
+    ranked = search_patents(query, k=cursor["offset"] + 2 * k + 1, mode=mode)
+    # Returns True if no similar patents exist. The best embedding match may have been fused out of the
+    # hybrid ranking or lack the prefilter's keywords, so only dense mode can reuse `ranked`.
+    best = [sim for _, sim, _ in ranked[:1]] if mode == "dense" else [sim for _, sim in rank_similar_patents(query, 1)]
+    is_novel = not best or best[0] < threshold
+    if mode != "hybrid":
+        ranked = [result for result in ranked if result[1] >= threshold]
+    page, next_cursor = paginate(ranked, cursor, k)
+    with stage("db"):
+        results = hydrate(page, fields)
+    return jsonify({
+        "isNovel": is_novel,
+        "results": results,
+        "next_cursor": next_cursor,
+    }), 200
+
+# Most queries one /search/batch request may carry, and how many of them are embedded and searched together.
+SEARCH_BATCH_MAX_QUERIES = int(os.getenv("SEARCH_BATCH_MAX_QUERIES", "10000"))
+SEARCH_BATCH_SIZE = int(os.getenv("SEARCH_BATCH_SIZE", "256"))
+
+def screen_queries(queries, k, threshold, fields):
+    """
+    Yield one {"index", "isNovel", "results"} verdict per query, in order.
+    Queries are embedded and searched SEARCH_BATCH_SIZE at a time, and the
+    patents found for each such slice are loaded with a single query.
+    """
+    for start in range(0, len(queries), SEARCH_BATCH_SIZE):
+        ranked = rank_similar_patents_batch(queries[start:start + SEARCH_BATCH_SIZE], k, batch_size=SEARCH_BATCH_SIZE)
+        matches = [[(patent_id, sim, sim) for patent_id, sim in results if sim >= threshold] for results in ranked]
+        with stage("db"):
+            patent_fields = load_patent_fields({patent_id for results in matches for patent_id, _, _ in results},
+                                               fields)
+        for offset, results in enumerate(matches):
+            yield {"index": start + offset, "isNovel": not results, "results": hydrate(results, fields, patent_fields)}
+
+@operations.route("/search/batch", methods=["POST"])
+def batch_search_route():
+    """
+    Screens many queries for novelty at once: {"queries": [...]} with the
+    same "k", "threshold" and "fields" as /search (dense mode, no cursor).
+    Returns {"results": [...]} with one {"index", "isNovel", "results"}
+    object per query, or, with "stream": true, those objects as NDJSON, one
+    line per query, sent as each slice of queries is searched.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "No JSON payload provided."}), 400
+
+    queries = data.get("queries")
+    if not isinstance(queries, list) or not queries or not all(isinstance(query, str) and query for query in queries):
+        return jsonify({"error": "Queries must be a non-empty list of non-empty strings."}), 400
+    if len(queries) > SEARCH_BATCH_MAX_QUERIES:
+        return jsonify({"error": f"At most {SEARCH_BATCH_MAX_QUERIES} queries are allowed per request."}), 400
+    if data.get("cursor"):
+        return jsonify({"error": "Batch searches are not paginated."}), 400
+    try:
+        k, threshold, fields, _ = parse_search_options(data)
+    except SearchRequestError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if data.get("stream"):
+        lines = (json.dumps(verdict) + "\n" for verdict in screen_queries(queries, k, threshold, fields))
+        return Response(stream_with_context(lines), mimetype="application/x-ndjson",
+                        headers={"X-Accel-Buffering": "no"})
+    return jsonify({"results": list(screen_queries(queries, k, threshold, fields))}), 200
+
+@operations.route("/stats", methods=["GET"])
+def stats_route():
+    """
+    Returns this worker's embedding batcher, cache and generation job counters,
+    and how far it has read the shared index (equal positions across workers
+    mean they have converged).
+    """
+    return jsonify({
+        "embedding_batcher": embedding_batcher.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "search_cache": search_cache.stats(),
+        "generation_jobs": generation_jobs.stats(),
+        "document_cache": document_cache.stats(),
+        "models": registry.stats(),
+        "stages": stage_timer.stats(),
+        "index_outbox": dict(index_outbox.stats(), pending=index_outbox.pending()),
+        "index": dict(get_index_store().position, ntotal=get_index_store().ntotal,
+                      generation=get_index_store().generation) if registry.loaded("index_store") else None,
+    }), 200
+
+@operations.route("/metrics", methods=["GET"])
+def metrics_route():
+    """
+    Prometheus metrics: latency histograms per stage (embed, index_search,
+    keyword_search, index_append, db, llm) and per endpoint.
+    """
+    metrics = stage_timer.metrics()
+    if metrics is None:
+        return jsonify({"error": "Metrics need the prometheus_client package."}), 501
+    body, content_type = metrics
+    return Response(body, content_type=content_type)
 
 @operations.route("/generate", methods=["POST"])
 def generate_patent_route():
     """
-    Generates a comprehensive patent document based on the provided title and description.
+    Queues generation of a comprehensive patent document based on the provided
+    title and description. Returns the job id right away; poll the status URL
+    or follow the stream URL (server-sent events) for the result. Documents
+    generated before are served from the cache unless "force_regenerate" is true.
+
+    With "mode": "sectioned" the seven sections are generated concurrently
+    and stitched together; "regenerate_section" (name or number) regenerates
+    just that section and reuses the cached others.
     """
     data = request.get_json()
     if not data:
@@ -208,5 +678,90 @@ def generate_patent_route():
     if not title or not description:
         return jsonify({"error": "Title and description are required."}), 400
 
-    generated_text = generate_patent_section(title, description)
-    return jsonify({"generated_patent_section": generated_text}), 200
+    mode = data.get("mode", GENERATION_MODE)
+    if mode not in ("single", "sectioned"):
+        return jsonify({"error": "Mode must be 'single' or 'sectioned'."}), 400
+    regenerate = None
+    if data.get("regenerate_section") is not None:
+        section = find_section(data["regenerate_section"])
+        if section is None:
+            names = ", ".join(name for name, _, _ in PATENT_SECTIONS)
+            return jsonify({"error": f"Unknown section. Expected a number 1-7 or one of: {names}."}), 400
+        mode, regenerate = "sectioned", {section}
+    elif data.get("force_regenerate"):
+        regenerate = set(range(len(PATENT_SECTIONS)))
+
+    client_key = request.headers.get("X-Client-Id") or request.remote_addr
+    cache_key = document_cache_key(title, description)
+    cached = None
+    if mode == "single" and not data.get("force_regenerate"):
+        with stage("db"):
+            cached = document_cache.get(cache_key)
+
+    if cached is not None:
+        job = generation_jobs.add_finished(client_key, cached)
+    else:
+        app = current_app._get_current_object()
+        if mode == "sectioned":
+            def work(emit):
+                with app.app_context():
+                    return generate_sectioned_document(title, description, on_token=emit, regenerate=regenerate)
+        else:
+            def work(emit):
+                content = complete_patent_document(title, description, on_token=emit)
+                with app.app_context():
+                    cache_patent_document(cache_key, title, content)
+                return content
+
+        try:
+            # Sectioned generation retries each section on its own; retrying the whole job as well
+            # would multiply the attempts.
+            job = generation_jobs.submit(client_key, work, retry=mode != "sectioned")
+        except JobLimitError as e:
+            return jsonify({"error": str(e)}), 429
+
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "cached": cached is not None,
+        "status_url": url_for("operations.generation_status_route", job_id=job.id),
+        "stream_url": url_for("operations.generation_stream_route", job_id=job.id),
+    }), 202
+
+@operations.route("/generate/<job_id>", methods=["GET"])
+def generation_status_route(job_id):
+    """
+    Returns a generation job's status, and the generated document once it is done.
+    """
+    job = generation_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Generation job not found."}), 404
+    return jsonify(job.to_dict()), 200
+
+@operations.route("/generate/<job_id>/stream", methods=["GET"])
+def generation_stream_route(job_id):
+    """
+    Streams a generation job's text as server-sent events: one "token" message
+    per chunk, then a final "done" or "error" event with the job status.
+    Reconnecting clients resume after the chunk named in Last-Event-ID.
+    """
+    job = generation_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Generation job not found."}), 404
+
+    last_event_id = request.headers.get("Last-Event-ID", "")
+    start = int(last_event_id) + 1 if last_event_id.isdigit() else 0
+
+    def events():
+        for index, chunk in job.follow(start):
+            if index is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"id: {index}\nevent: token\ndata: {json.dumps({'token': chunk})}\n\n"
+        yield f"event: {job.status}\ndata: {json.dumps(job.to_dict(include_result=False))}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
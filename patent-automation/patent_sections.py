@@ -0,0 +1,222 @@
+# patent_sections.py
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# The seven sections of a generated patent: (name, heading with length target, guidelines).
+PATENT_SECTIONS = [
+    ("Abstract", "Abstract (500+ words)", [
+        "Provide a clear, scientific, and technical summary of the invention.",
+        "Use formal engineering language, precise terminology, and industry-standard concepts.",
+        "Highlight performance improvements, novel aspects, and how the invention surpasses prior art.",
+    ]),
+    ("Background", "Background & Problem Statement (600+ words)", [
+        "Explain the industry challenges, scientific limitations, and technological gaps that necessitate this invention.",
+        "Reference existing patents, academic papers, or industry standards.",
+        "Discuss the inefficiencies or flaws in current solutions.",
+    ]),
+    ("Summary", "Summary of the Invention (700+ words)", [
+        "Describe how the invention solves the identified problem.",
+        "Include technical comparisons, performance benchmarks, and novel technical mechanisms.",
+        "Provide quantitative improvements over existing technology.",
+    ]),
+    ("Claims", "Claims (Legal Section) (800+ words)", [
+        "Structure broad independent claims followed by detailed dependent claims.",
+        "Ensure claim wording is legally defensible and specific to prevent infringement loopholes.",
+        "Use precise, numbered, structured formatting (e.g., \"1. A system comprising...\").",
+        "Cover all possible variations of the invention to maximize patent coverage.",
+    ]),
+    ("Detailed Description", "Detailed Description (1500+ words)", [
+        "Technical Breakdown: Explain the system architecture, key components, and operational flow.",
+        "Material Science & Composition: Describe chemical, molecular, or nanomaterial structures if applicable.",
+        "Electrical & Mechanical Design: Provide circuit diagrams, flowcharts, stress analysis, and component details.",
+        "Software & AI/ML Algorithms: Discuss the training dataset, model architecture, optimization methods, and algorithmic flow.",
+        "Thermal & Structural Analysis: Explain how the design handles heat dissipation, mechanical stress, and energy transfer.",
+        "Manufacturing & Scalability: Describe production methods, feasibility of large-scale deployment, and potential modifications.",
+    ]),
+    ("Figures", "Figures & Illustrations (Placeholder Texts)", [
+        "Insert placeholders such as [Figure 1: System Architecture Diagram] and [Table 1: Performance Comparison].",
+        "Describe what each diagram should illustrate.",
+    ]),
+    ("Industrial Applications", "Industrial Applications & Market Feasibility (500+ words)", [
+        "Discuss real-world use cases, market adoption, regulatory hurdles, and future scalability.",
+        "Mention government compliance, patent licensing opportunities, and the competitive landscape.",
+    ]),
+]
+
+FORMATTING_RULES = [
+    "Use highly technical, legally precise, and engineering-driven language.",
+    "Include scientific formulas, performance metrics, and comparative data.",
+    "Use formal structured headings and numbered subsections.",
+]
+
+PROMPT_INTRO = """You are an expert patent writer with deep knowledge of engineering, AI, physics, chemistry, and law.
+Write a comprehensive, legally robust, and highly technical patent document for the given invention."""
+
+
+def _section_outline(index):
+    _, heading, guidelines = PATENT_SECTIONS[index]
+    return f"{index + 1}. {heading}\n" + "\n".join(f"   - {line}" for line in guidelines)
+
+
+def _formatting_rules(extra_rules):
+    return "📌 Formatting Rules:\n" + "\n".join(f"- {rule}" for rule in FORMATTING_RULES + extra_rules)
+
+
+def build_patent_prompt(title, description):
+    """
+    Build the user prompt asking GPT-4 for the full seven-section patent document.
+    """
+    outline = "\n\n".join(_section_outline(i) for i in range(len(PATENT_SECTIONS)))
+    return f"""{PROMPT_INTRO}
+
+---
+📌 Patent Structure & Guidelines:
+
+{outline}
+
+---
+{_formatting_rules(["Ensure the output is at least 5000 words in total."])}
+
+📌 Patent Title: {title}
+📌 Patent Description: {description}
+"""
+
+
+def build_section_prompt(title, description, index):
+    """
+    Build the prompt for one section. Every section shares the same context
+    header (invention, full outline and formatting rules) so that separately
+    generated sections stay consistent with each other.
+    """
+    outline = "\n".join(f"{i + 1}. {heading}" for i, (_, heading, _) in enumerate(PATENT_SECTIONS))
+    return f"""{PROMPT_INTRO}
+The document is written one section at a time; other sections are written separately.
+
+---
+📌 Full Document Outline:
+{outline}
+
+---
+{_formatting_rules([])}
+
+📌 Patent Title: {title}
+📌 Patent Description: {description}
+
+---
+📌 Write ONLY the following section, starting with its heading and without repeating other sections:
+
+{_section_outline(index)}
+"""
+
+
+def find_section(name_or_number):
+    """
+    Resolve a section name (case-insensitive) or 1-based number to its index.
+    Returns None if it does not match any section.
+    """
+    value = str(name_or_number).strip()
+    if value.isdigit() and 1 <= int(value) <= len(PATENT_SECTIONS):
+        return int(value) - 1
+    for index, (name, heading, _) in enumerate(PATENT_SECTIONS):
+        if value.casefold() in (name.casefold(), heading.casefold()):
+            return index
+    return None
+
+
+def stitch_sections(texts):
+    """
+    Join section texts into one document, in section order.
+    """
+    return "\n\n".join(text.strip() for text in texts)
+
+
+class OrderedEmitter:
+    """
+    Forwards text from concurrently generated sections in document order:
+    the earliest unfinished section streams live, later ones are buffered
+    until every section before them has finished.
+    """
+
+    def __init__(self, count, emit):
+        self.emit = emit
+        self.buffers = [[] for _ in range(count)]
+        self.finished = [False] * count
+        self.current = 0
+        self._lock = threading.Lock()
+
+    def token(self, index, text):
+        with self._lock:
+            if index == self.current:
+                self.emit(text)
+            else:
+                self.buffers[index].append(text)
+
+    def finish(self, index):
+        with self._lock:
+            self.finished[index] = True
+            while self.current < len(self.finished) and self.finished[self.current]:
+                self.current += 1
+                if self.current < len(self.buffers):
+                    for text in self.buffers[self.current]:
+                        self.emit(text)
+                    self.buffers[self.current].clear()
+
+
+def generate_sections(texts, complete_section, on_token=None, retry_on=(), max_retries=4, backoff_seconds=2.0,
+                      executor=None):
+    """
+    Fill in the missing (None) entries of `texts` concurrently by calling
+    `complete_section(index, emit)` on `executor`; it returns the section's
+    text and may stream chunks through `emit`. Entries already present
+    (e.g. cached sections) are reused as is. Pass one executor shared by
+    every job to bound the completions running at once; without one, a
+    thread per section is started for this call.
+
+    `texts` is updated in place as sections finish, so callers can keep the
+    sections that succeeded even if another one raised. Errors in `retry_on`
+    are retried with exponential backoff while the section has not streamed
+    anything yet. If `on_token` is given, all text is passed to it in
+    document order.
+    """
+    emitter = OrderedEmitter(len(texts), on_token) if on_token else None
+
+    def run(index):
+        if texts[index] is None:
+            streamed = []
+
+            def emit(text):
+                streamed.append(text)
+                if emitter:
+                    emitter.token(index, text)
+
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    texts[index] = complete_section(index, emit)
+                    break
+                except retry_on:
+                    if streamed or attempt > max_retries:
+                        raise
+                    delay = backoff_seconds * 2 ** (attempt - 1)
+                    time.sleep(delay + random.uniform(0, delay / 2))
+        elif emitter:
+            emitter.token(index, texts[index])
+        if emitter:
+            if index < len(texts) - 1:
+                emitter.token(index, "\n\n")
+            emitter.finish(index)
+
+    if executor is None:
+        missing = [i for i, text in enumerate(texts) if text is None]
+        with ThreadPoolExecutor(max_workers=max(1, len(missing))) as executor:
+            return generate_sections(texts, complete_section, on_token, retry_on, max_retries, backoff_seconds,
+                                     executor)
+    futures = [executor.submit(run, i) for i in range(len(texts))]
+    # Let every section finish before raising, so the caller can keep the ones that succeeded.
+    wait(futures)
+    for future in futures:
+        future.result()
+    return texts
@@ -0,0 +1,124 @@
+# search_results.py
+import base64
+import binascii
+import json
+
+from sqlalchemy import select
+from sqlalchemy.orm import load_only
+
+from extensions import db
+from models import Patent
+
+DEFAULT_K = 5
+MAX_K = 100
+DEFAULT_THRESHOLD = 0.8
+# Deepest result a cursor may page to: every page re-ranks from the top, so deep pages cost large searches.
+MAX_OFFSET = 10 * MAX_K
+# Patent columns a search can return next to each result's id and scores.
+SEARCH_FIELDS = ("title", "description")
+
+
+class SearchRequestError(ValueError):
+    """
+    Raised for invalid /search parameters; the message is returned to the client.
+    """
+
+
+def parse_search_options(data):
+    """
+    Validate the shared /search options: "k" (results per page), "threshold",
+    "fields" (projection, default every field in SEARCH_FIELDS) and "cursor".
+    Returns (k, threshold, fields, cursor) with the cursor decoded.
+    """
+    try:
+        k = int(data.get("k", DEFAULT_K))
+        threshold = float(data.get("threshold", DEFAULT_THRESHOLD))
+    except (TypeError, ValueError):
+        raise SearchRequestError("k must be an integer and threshold a number.")
+    if not 1 <= k <= MAX_K:
+        raise SearchRequestError(f"k must be between 1 and {MAX_K}.")
+    if not -1.0 <= threshold <= 1.0:
+        raise SearchRequestError("threshold must be between -1 and 1.")
+
+    fields = data.get("fields", list(SEARCH_FIELDS))
+    if not isinstance(fields, list) or not set(fields) <= set(SEARCH_FIELDS):
+        raise SearchRequestError(f"fields must be a list drawn from: {', '.join(SEARCH_FIELDS)}.")
+    return k, threshold, [field for field in SEARCH_FIELDS if field in fields], decode_cursor(data.get("cursor"))
+
+
+def encode_cursor(offset, last_patent_id):
+    payload = json.dumps({"offset": offset, "after": last_patent_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor from a previous page into {"offset", "after"}; None
+    (the first page) decodes to offset 0. Offsets past MAX_OFFSET are
+    rejected.
+    """
+    if not cursor:
+        return {"offset": 0, "after": None}
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        offset, after = int(payload["offset"]), payload["after"]
+    except (binascii.Error, ValueError, TypeError, KeyError, AttributeError):
+        raise SearchRequestError("Invalid cursor.")
+    if offset < 0:
+        raise SearchRequestError("Invalid cursor.")
+    if offset > MAX_OFFSET:
+        raise SearchRequestError(f"Only the first {MAX_OFFSET} results can be paged through.")
+    return {"offset": offset, "after": after}
+
+
+def paginate(ranked, cursor, k):
+    """
+    Cut one page of `k` results out of the full `ranked` list of
+    (patent_id, similarity, score) tuples. The page starts right after the
+    previous page's last patent, so a patent added meanwhile does not
+    shift results into the next page twice; if that patent is gone, the
+    previous offset is used. Returns (page, next_cursor or None); there is
+    no next page past MAX_OFFSET.
+    """
+    start = cursor["offset"]
+    if cursor["after"] is not None:
+        positions = [i for i, (patent_id, _, _) in enumerate(ranked) if patent_id == cursor["after"]]
+        if positions:
+            start = positions[0] + 1
+    page = ranked[start:start + k]
+    more = page and len(ranked) > start + k and start + len(page) <= MAX_OFFSET
+    next_cursor = encode_cursor(start + len(page), page[-1][0]) if more else None
+    return page, next_cursor
+
+
+def load_patent_fields(patent_ids, fields):
+    """
+    Fetch the requested Patent columns for `patent_ids` with a single IN
+    query loading only those columns. Returns {patent_id: {field: value}};
+    patents no longer in the database are missing from it. Needs an app context.
+    """
+    if not patent_ids:
+        return {}
+    if not fields:
+        return {patent_id: {} for patent_id in patent_ids}
+    patents = db.session.scalars(
+        select(Patent)
+        .where(Patent.id.in_(set(patent_ids)))
+        .options(load_only(*[getattr(Patent, field) for field in fields]))
+    )
+    return {patent.id: {field: getattr(patent, field) for field in fields} for patent in patents}
+
+
+def hydrate(results, fields, patent_fields=None):
+    """
+    Turn (patent_id, similarity, score) results into response rows with the
+    requested Patent columns, loaded with load_patent_fields unless
+    `patent_fields` is given. Patents no longer in the database are left out.
+    """
+    if patent_fields is None:
+        patent_fields = load_patent_fields([patent_id for patent_id, _, _ in results], fields)
+    return [
+        {"patent_id": patent_id, "similarity": sim, "score": score, **patent_fields[patent_id]}
+        for patent_id, sim, score in results
+        if patent_id in patent_fields
+    ]
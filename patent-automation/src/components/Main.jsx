@@ -13,23 +13,41 @@ export default function Main() {
   const { title, description } = location.state || {};
 
   useEffect(() => {
+    let events;
     const getPatentData = async () => {
       try {
         setIsLoading(true);
+        setPatentData("");
+        // /generate queues a job; its text is streamed back as server-sent events.
         const response = await axios.post("http://localhost:5000/generate", {
           title: title,
           description: description,
         });
-        if (response.status === 200) {
-          setPatentData(response.data.generated_patent_section);
+        if (response.status !== 202) {
+          setIsLoading(false);
+          return;
         }
+        events = new EventSource(`http://localhost:5000${response.data.stream_url}`);
+        events.addEventListener("token", (event) => {
+          const { token } = JSON.parse(event.data);
+          setIsLoading(false);
+          setPatentData((text) => text + token);
+        });
+        events.addEventListener("done", () => events.close());
+        events.addEventListener("error", (event) => {
+          if (event.data) {
+            setPatentData(JSON.parse(event.data).error);
+          }
+          events.close();
+          setIsLoading(false);
+        });
       } catch (error) {
         console.error("Error fetching patent data:", error);
-      } finally {
         setIsLoading(false);
       }
     };
     getPatentData();
+    return () => events && events.close();
   }, [title, description]);
 
   const novelty = async () => {
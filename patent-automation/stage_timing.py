@@ -0,0 +1,102 @@
+# stage_timing.py
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+try:
+    import prometheus_client
+except ImportError:  # Optional: without it there is no /metrics, but Server-Timing and /stats still work.
+    prometheus_client = None
+
+# Latency buckets in seconds, from sub-millisecond index searches to multi-minute generations.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+           120.0, 300.0)
+
+
+class StageTimer:
+    """
+    Times the stages of the hot paths (embedding, index search, database,
+    LLM calls...) wherever they run.
+
+    Every `stage(name)` block is counted in this process's totals (see
+    `stats()`) and, when prometheus_client is installed, in a histogram
+    labelled by stage. Stages run during a request are also summed per
+    request and sent back in its Server-Timing header, next to the total.
+    Set PROMETHEUS_MULTIPROC_DIR to aggregate the metrics of every gunicorn
+    worker (see gunicorn.conf.py).
+    """
+
+    def __init__(self, prefix="patent_api"):
+        self._lock = threading.Lock()
+        self._totals = {}
+        if prometheus_client is not None:
+            self._stage_seconds = prometheus_client.Histogram(
+                f"{prefix}_stage_seconds", "Time spent in each stage of request handling and jobs.",
+                ["stage"], buckets=BUCKETS,
+            )
+            self._request_seconds = prometheus_client.Histogram(
+                f"{prefix}_request_seconds", "Time to the response headers, per endpoint.",
+                ["endpoint", "method", "status"], buckets=BUCKETS,
+            )
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            count, total, longest = self._totals.get(name, (0, 0.0, 0.0))
+            self._totals[name] = (count + 1, total + seconds, max(longest, seconds))
+        if prometheus_client is not None:
+            self._stage_seconds.labels(name).observe(seconds)
+        if has_request_context() and "stage_seconds" in g:
+            g.stage_seconds[name] = g.stage_seconds.get(name, 0.0) + seconds
+
+    def start_request(self):
+        g.stage_seconds = {}
+        g.request_started = time.perf_counter()
+
+    def finish_request(self, response):
+        """
+        Add the Server-Timing header to `response` and record the request.
+        """
+        if "request_started" not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_started
+        timings = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in g.stage_seconds.items()]
+        timings.append(f"total;dur={elapsed * 1000:.2f}")
+        response.headers["Server-Timing"] = ", ".join(timings)
+        if prometheus_client is not None:
+            self._request_seconds.labels(request.endpoint or "unknown", request.method,
+                                         str(response.status_code)).observe(elapsed)
+        return response
+
+    def metrics(self):
+        """
+        (body, content type) of the Prometheus metrics, or None without prometheus_client.
+        """
+        if prometheus_client is None:
+            return None
+        if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            from prometheus_client import multiprocess
+
+            registry = prometheus_client.CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = prometheus_client.REGISTRY
+        return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {"count": count, "total_seconds": total, "mean_ms": total / count * 1000,
+                       "max_ms": longest * 1000}
+                for name, (count, total, longest) in self._totals.items()
+            }
@@ -0,0 +1,182 @@
+# stress_index.py
+"""
+Stress test of concurrent index writes: several worker processes, each with
+several threads, submit and search patents at the same time against one
+database and one index directory, like gunicorn workers would:
+
+    python stress_index.py --workers 4 --threads 8 --submits 50
+    python stress_index.py --database-uri postgresql://localhost/patents_stress
+
+Every submitted patent must be found by a search for its own description
+right after /submit returns. Some patents are committed with an outbox row
+but never drained by their request, as if the worker had died right after
+its commit; the background appliers must index those too. At the end every
+worker must report the same index position, and the index and the database
+must hold the same patents. A bag-of-words hashing embedder stands in for
+the sentence model (see bench_search.py).
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+
+def run_worker(worker, args, barrier, results):
+    from app import app
+    from extensions import db
+    from models import IndexOutbox, Patent
+    import operations
+
+    client = app.test_client()
+    rng = np.random.default_rng(worker)
+    report = {"worker": worker, "submitted": 0, "orphaned": 0, "not_found": [], "errors": [],
+              "submit_ms": [], "search_ms": []}
+    lock = threading.Lock()
+
+    def submit_and_search(thread):
+        for i in range(args.submits):
+            tag = f"w{worker}t{thread}n{i}"
+            description = " ".join(f"term{w}" for w in rng.integers(0, 5000, size=30)) + f" stress{tag}"
+            if args.orphan_every and i % args.orphan_every == args.orphan_every - 1:
+                # Committed with its outbox row, but never drained by a request.
+                with app.app_context():
+                    patent = Patent(title=f"Orphan {tag}", description=description)
+                    db.session.add(patent)
+                    db.session.flush()
+                    db.session.add(IndexOutbox(patent_id=patent.id, created_at=datetime.utcnow()))
+                    db.session.commit()
+                with lock:
+                    report["orphaned"] += 1
+                continue
+
+            started = time.perf_counter()
+            response = client.post("/submit", json={"title": f"Patent {tag}", "description": description})
+            submitted = time.perf_counter()
+            if response.status_code != 200:
+                with lock:
+                    report["errors"].append(response.get_json())
+                continue
+            patent_id = response.get_json()["patent_id"]
+            response = client.post("/search", json={"query": description, "k": 1, "threshold": 0.99,
+                                                    "fields": []})
+            searched = time.perf_counter()
+            results = response.get_json().get("results", [])
+            with lock:
+                report["submitted"] += 1
+                report["submit_ms"].append((submitted - started) * 1000)
+                report["search_ms"].append((searched - submitted) * 1000)
+                if not results or results[0]["patent_id"] != patent_id:
+                    report["not_found"].append(patent_id)
+
+    threads = [threading.Thread(target=submit_and_search, args=(t,)) for t in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Wait until the background appliers have indexed the orphans, then let every worker catch up.
+    barrier.wait()
+    deadline = time.monotonic() + args.timeout
+    with app.app_context():
+        while operations.index_outbox.pending() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        report["pending"] = operations.index_outbox.pending()
+        report["outbox"] = operations.index_outbox.stats()
+    barrier.wait()
+    index_store = operations.get_index_store()
+    index_store.refresh()
+    report["position"] = index_store.position
+    report["ntotal"] = index_store.ntotal
+    results.put(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress concurrent /submit and /search across worker processes.")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--submits", type=int, default=25, help="Patents submitted per thread.")
+    parser.add_argument("--orphan-every", type=int, default=10,
+                        help="Commit every n-th patent without draining the outbox (0: never).")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for the outbox to drain.")
+    parser.add_argument("--database-uri", default=None, help="Database to use (default: SQLite in a temp dir).")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="stress_index_")
+    os.environ.update(
+        FAISS_INDEX_DIR=directory,
+        DATABASE_URI=args.database_uri or f"sqlite:///{os.path.join(directory, 'stress.db')}?timeout=60",
+        INDEX_SYNC_INTERVAL="0.2",
+        SEARCH_CACHE_MB="0",
+    )
+    from app import app
+    from bench_search import HashingEmbedder
+    from extensions import db
+    from index_store import IndexStore
+    from model_registry import registry
+    from models import Patent
+    import operations
+
+    registry.register("embedding_model", lambda: HashingEmbedder(operations.dimension))
+    with app.app_context():
+        db.create_all()
+
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(args.workers)
+    results = context.Queue()
+    started = time.perf_counter()
+    processes = [context.Process(target=run_worker, args=(worker, args, barrier, results))
+                 for worker in range(args.workers)]
+    for process in processes:
+        process.start()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        patent_ids = set(db.session.scalars(db.select(Patent.id)))
+    store = IndexStore(directory, operations.dimension)
+    indexed_ids = set(np.asarray(store.base_ids).tolist()) | set(store.delta_ids)
+
+    submit_ms = [ms for report in reports for ms in report["submit_ms"]]
+    search_ms = [ms for report in reports for ms in report["search_ms"]]
+    print(f"{len(patent_ids)} patents from {args.workers} workers x {args.threads} threads in {elapsed:.1f}s")
+    for name, samples in (("submit", submit_ms), ("search", search_ms)):
+        if samples:
+            samples.sort()
+            print(f"  {name}: mean {statistics.fmean(samples):.1f} ms, "
+                  f"p95 {samples[min(len(samples) - 1, int(len(samples) * 0.95))]:.1f} ms")
+    for report in reports:
+        print(f"  worker {report['worker']}: {report['submitted']} submitted, {report['orphaned']} orphaned, "
+              f"position {report['position']}, {report['ntotal']} vectors, outbox {report['outbox']}")
+
+    failures = []
+    errors = [error for report in reports for error in report["errors"]]
+    if errors:
+        failures.append(f"{len(errors)} submissions failed, e.g. {errors[0]}")
+    not_found = [patent_id for report in reports for patent_id in report["not_found"]]
+    if not_found:
+        failures.append(f"{len(not_found)} patents not found right after /submit, e.g. {not_found[:5]}")
+    if any(report["pending"] for report in reports):
+        failures.append(f"outbox not drained after {args.timeout}s: {reports[0]['pending']} rows pending")
+    if len({tuple(sorted(report["position"].items())) for report in reports}) != 1:
+        failures.append("workers did not converge on one index position")
+    if indexed_ids != patent_ids:
+        failures.append(f"{len(patent_ids - indexed_ids)} patents missing from the index, "
+                        f"{len(indexed_ids - patent_ids)} indexed ids not in the database")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK: every patent searchable after /submit; workers converged; index matches the database.")
+
+
+if __name__ == "__main__":
+    main()